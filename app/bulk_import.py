@@ -0,0 +1,378 @@
+# app/bulk_import.py
+"""
+Bulk import of conversation history from NDJSON.
+
+    python -m app.bulk_import history.ndjson.gz --source legacy
+    POST /api/import?source=legacy   (body: NDJSON, optionally Content-Encoding: gzip)
+
+The input is the format GET /api/export writes: one JSON object per line
+whose "record" is user, conversation, message or element, with the model's
+columns as the other keys (cursor and end records are ignored). Users must
+precede the conversations that reference them, and conversations their
+messages and elements, as in an export.
+
+Records are buffered up to IMPORT_BATCH_SIZE at a time, copied into
+temporary staging tables with COPY and moved into the real tables with one
+INSERT ... SELECT per table, so memory use does not depend on the input
+size. Users are matched by username. Conversations get new ids; the
+(source, old id) -> new id mapping is kept in imported_conversation, so
+running the same import again only adds what is missing. Messages and
+elements keep their UUIDs. Replies are inserted without their parent and
+linked in bulk once the parent exists, wherever it appears in the input.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import sys
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Optional
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import DateTime, String, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from .database import engine
+from .metrics import Counter
+from .models import Conversation, Element, Message, User
+from .utilities import parse_created_at
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 10_000
+# First key of the advisory lock that keeps two imports of one source apart
+IMPORT_LOCK_ID = 0x696D_706F
+
+IMPORTED_ROWS = Counter("import_rows_total", "Rows inserted by the bulk import", ["table"])
+
+router = APIRouter()
+
+# record type -> (model, staged columns)
+RECORDS = {
+    "user": (User, ("id", "username", "createdAt", "role", "image", "provider", "tags")),
+    "conversation": (Conversation, ("id", "createdAt", "isError", "appUserId", "tags")),
+    "message": (Message, (
+        "id", "conversation_id", "createdAt", "author", "content", "language", "prompt", "parentId", "indent",
+        "isError", "authorIsUser", "disableHumanFeedback", "waitForAnswer", "humanFeedback", "humanFeedbackComment",
+    )),
+    "element": (Element, (
+        "id", "conversation_id", "type", "name", "mime", "url", "display", "language", "size", "object_key", "for_ids",
+    )),
+}
+IGNORED_RECORDS = ("cursor", "end")
+
+
+def _staging_ddl(record_type: str, model, columns) -> str:
+    # Same column types as the real table, without its constraints
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    return f"CREATE TEMP TABLE import_{record_type} AS SELECT {column_list} FROM {model.__tablename__} WITH NO DATA"
+
+
+STAGING_DDL = [_staging_ddl(record_type, model, columns) for record_type, (model, columns) in RECORDS.items()] + [
+    "CREATE TEMP TABLE import_user_map (source_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL)",
+    # Replies whose parent has not been imported yet
+    'CREATE TEMP TABLE import_parent (id UUID PRIMARY KEY, "parentId" UUID NOT NULL)',
+]
+STAGING_TABLES = [f"import_{record_type}" for record_type in RECORDS] + ["import_user_map", "import_parent"]
+
+INSERT_USERS = """
+INSERT INTO app_user (username, "createdAt", role, image, provider, tags)
+SELECT DISTINCT ON (username) username, coalesce("createdAt", now()), coalesce(role, 'USER'), image, provider,
+       coalesce(tags, '[]')
+FROM import_user
+WHERE username IS NOT NULL
+ORDER BY username
+ON CONFLICT (username) DO NOTHING
+"""
+MAP_USERS = """
+INSERT INTO import_user_map (source_id, user_id)
+SELECT DISTINCT ON (s.id) s.id, u.id
+FROM import_user s JOIN app_user u ON u.username = s.username
+WHERE s.id IS NOT NULL
+ORDER BY s.id
+ON CONFLICT (source_id) DO UPDATE SET user_id = EXCLUDED.user_id
+"""
+# New ids are drawn up front so the mapping and the rows go in with one statement
+INSERT_CONVERSATIONS = """
+WITH new AS (
+    SELECT DISTINCT ON (s.id) s.id AS source_id, nextval(pg_get_serial_sequence('conversation', 'id')) AS id,
+           s."createdAt", s."isError", s."appUserId", s.tags
+    FROM import_conversation s
+    WHERE s.id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM imported_conversation i WHERE i.source = :source AND i.source_id = s.id)
+    ORDER BY s.id
+), inserted AS (
+    INSERT INTO conversation (id, "createdAt", "isError", "appUserId", tags)
+    SELECT new.id, coalesce(new."createdAt", now()), coalesce(new."isError", false), u.user_id,
+           coalesce(new.tags, '[]')
+    FROM new LEFT JOIN import_user_map u ON u.source_id = new."appUserId"
+)
+INSERT INTO imported_conversation (source, source_id, conversation_id)
+SELECT :source, source_id, id FROM new
+"""
+INSERT_MESSAGES = """
+INSERT INTO message (
+    id, conversation_id, "createdAt", author, content, language, prompt, indent, "isError", "authorIsUser",
+    "disableHumanFeedback", "waitForAnswer", "humanFeedback", "humanFeedbackComment"
+)
+SELECT DISTINCT ON (s.id) s.id, i.conversation_id, coalesce(s."createdAt", now()), s.author, s.content, s.language,
+       s.prompt, coalesce(s.indent, 0), coalesce(s."isError", false), coalesce(s."authorIsUser", false),
+       coalesce(s."disableHumanFeedback", false), coalesce(s."waitForAnswer", false), s."humanFeedback",
+       s."humanFeedbackComment"
+FROM import_message s
+JOIN imported_conversation i ON i.source = :source AND i.source_id = s.conversation_id
+WHERE s.id IS NOT NULL AND s.content IS NOT NULL
+  -- A partitioned message table has no unique index on id alone
+  AND NOT EXISTS (SELECT 1 FROM message m WHERE m.id = s.id)
+ORDER BY s.id
+ON CONFLICT DO NOTHING
+"""
+# Only messages that are here and not linked yet, so re-runs stage nothing
+STAGE_PARENTS = """
+INSERT INTO import_parent (id, "parentId")
+SELECT DISTINCT ON (s.id) s.id, s."parentId"
+FROM import_message s
+WHERE s."parentId" IS NOT NULL
+  AND EXISTS (SELECT 1 FROM message m WHERE m.id = s.id AND m."parentId" IS NULL)
+ORDER BY s.id
+ON CONFLICT (id) DO NOTHING
+"""
+LINK_PARENTS = """
+WITH resolved AS (
+    DELETE FROM import_parent p
+    WHERE EXISTS (SELECT 1 FROM message m WHERE m.id = p."parentId")
+    RETURNING p.id, p."parentId"
+)
+UPDATE message SET "parentId" = resolved."parentId"
+FROM resolved
+WHERE message.id = resolved.id AND message."parentId" IS NULL
+"""
+INSERT_ELEMENTS = """
+INSERT INTO element (id, conversation_id, type, name, mime, url, display, language, size, object_key, for_ids)
+SELECT DISTINCT ON (s.id) s.id, i.conversation_id, s.type, s.name, s.mime, s.url, s.display, s.language, s.size,
+       s.object_key, s.for_ids
+FROM import_element s
+JOIN imported_conversation i ON i.source = :source AND i.source_id = s.conversation_id
+WHERE s.id IS NOT NULL AND s.type IS NOT NULL AND s.name IS NOT NULL
+ORDER BY s.id
+ON CONFLICT (id) DO NOTHING
+"""
+
+
+def _uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _converters(model, columns):
+    """
+    Converts JSON values into what asyncpg's binary COPY expects for each column.
+    """
+    converters = []
+    for name in columns:
+        column_type = model.__table__.c[name].type
+        if isinstance(column_type, DateTime):
+            converters.append(parse_created_at)
+        elif isinstance(column_type, UUID):
+            converters.append(_uuid)
+        elif isinstance(column_type, JSONB):
+            converters.append(json.dumps)
+        elif isinstance(column_type, String):
+            converters.append(str)
+        else:
+            converters.append(None)
+    return converters
+
+
+CONVERTERS = {record_type: _converters(model, columns) for record_type, (model, columns) in RECORDS.items()}
+
+
+@dataclass
+class ImportStats:
+    lines: int = 0
+    # Records read, by record type
+    read: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(RECORDS, 0))
+    # Rows inserted, by record type; the difference to `read` was already there or had no conversation
+    inserted: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(RECORDS, 0))
+    parents_linked: int = 0
+    # Replies whose parent never appeared; they stay top-level messages
+    parents_missing: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def as_dict(self) -> dict:
+        return {
+            "lines": self.lines,
+            "read": self.read,
+            "inserted": self.inserted,
+            "parents_linked": self.parents_linked,
+            "parents_missing": self.parents_missing,
+            "seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+
+class BulkImporter:
+    """
+    Imports records from one source over a single connection, which holds
+    the staging tables and the source's advisory lock for the whole run.
+    """
+
+    def __init__(self, conn, source: str, batch_size: int = IMPORT_BATCH_SIZE, progress: Optional[Callable] = None):
+        self.conn = conn
+        self.source = source
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = ImportStats()
+        self.buffers = {record_type: [] for record_type in RECORDS}
+        self.buffered = 0
+
+    async def run(self, lines: AsyncIterator[bytes]) -> ImportStats:
+        await self.conn.execute(text("SELECT pg_advisory_lock(:lock, hashtext(:source))"),
+                                {"lock": IMPORT_LOCK_ID, "source": self.source})
+        try:
+            for ddl in STAGING_DDL:
+                await self.conn.exec_driver_sql(ddl)
+            await self.conn.commit()
+            async for line in lines:
+                self.add(line)
+                if self.buffered >= self.batch_size:
+                    await self.flush()
+            await self.flush()
+            self.stats.parents_missing = await self.conn.scalar(text("SELECT count(*) FROM import_parent"))
+        finally:
+            await self.conn.rollback()
+            await self.conn.exec_driver_sql(f"DROP TABLE IF EXISTS {', '.join(STAGING_TABLES)}")
+            await self.conn.execute(text("SELECT pg_advisory_unlock(:lock, hashtext(:source))"),
+                                    {"lock": IMPORT_LOCK_ID, "source": self.source})
+            await self.conn.commit()
+        return self.stats
+
+    def add(self, line: bytes):
+        self.stats.lines += 1
+        if not line.strip():
+            return
+        try:
+            data = json.loads(line)
+            record_type = data["record"]
+            if record_type in IGNORED_RECORDS:
+                return
+            columns = RECORDS[record_type][1]
+            row = tuple(
+                None if data.get(column) is None else convert(data[column]) if convert else data[column]
+                for column, convert in zip(columns, CONVERTERS[record_type])
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Line {self.stats.lines}: invalid record ({e}).")
+        self.buffers[record_type].append(row)
+        self.stats.read[record_type] += 1
+        self.buffered += 1
+
+    async def flush(self):
+        if not self.buffered:
+            return
+        raw = await self.conn.get_raw_connection()
+        for record_type, rows in self.buffers.items():
+            if rows:
+                await raw.driver_connection.copy_records_to_table(
+                    f"import_{record_type}", records=rows, columns=RECORDS[record_type][1]
+                )
+                rows.clear()
+        self.buffered = 0
+
+        params = {"source": self.source}
+        inserted = {}
+        inserted["user"] = (await self.conn.execute(text(INSERT_USERS))).rowcount
+        await self.conn.execute(text(MAP_USERS))
+        inserted["conversation"] = (await self.conn.execute(text(INSERT_CONVERSATIONS), params)).rowcount
+        inserted["message"] = (await self.conn.execute(text(INSERT_MESSAGES), params)).rowcount
+        await self.conn.execute(text(STAGE_PARENTS))
+        self.stats.parents_linked += (await self.conn.execute(text(LINK_PARENTS))).rowcount
+        inserted["element"] = (await self.conn.execute(text(INSERT_ELEMENTS), params)).rowcount
+        await self.conn.exec_driver_sql(f"TRUNCATE {', '.join(f'import_{record_type}' for record_type in RECORDS)}")
+        await self.conn.commit()
+
+        for record_type, count in inserted.items():
+            self.stats.inserted[record_type] += count
+            IMPORTED_ROWS.inc(count, table=record_type)
+        logger.info("Imported batch", extra={"source": self.source, **self.stats.as_dict()})
+        if self.progress is not None:
+            self.progress(self.stats)
+
+
+async def bulk_import(lines: AsyncIterator[bytes], source: str, batch_size: int = IMPORT_BATCH_SIZE,
+                      progress: Optional[Callable] = None) -> ImportStats:
+    """
+    Imports NDJSON lines and returns what was read and inserted. Each batch
+    commits on its own; after a failure, running the same import again
+    continues where it stopped.
+    """
+    async with engine.connect() as conn:
+        return await BulkImporter(conn, source, batch_size, progress).run(lines)
+
+
+async def split_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def gunzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(wbits=47)
+    async for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+@router.post("/api/import")
+async def import_history(request: Request, source: str = "import"):
+    chunks = request.stream()
+    if request.headers.get("content-encoding") == "gzip":
+        chunks = gunzip_stream(chunks)
+    try:
+        stats = await bulk_import(split_lines(chunks), source)
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(400, str(e))
+    return stats.as_dict()
+
+
+async def read_file(path: str) -> AsyncIterator[bytes]:
+    if path == "-":
+        input_file = sys.stdin.buffer
+    elif path.endswith(".gz"):
+        input_file = gzip.open(path, "rb")
+    else:
+        input_file = open(path, "rb")
+    with input_file:
+        for line in input_file:
+            yield line
+
+
+def print_progress(stats: ImportStats):
+    summary = stats.as_dict()
+    rate = stats.lines / summary["seconds"] if summary["seconds"] else 0
+    inserted = ", ".join(f"{count:,} {record_type}s" for record_type, count in stats.inserted.items())
+    print(f"{stats.lines:,} lines ({rate:,.0f}/s): inserted {inserted}", file=sys.stderr)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Import conversation history from NDJSON.")
+    parser.add_argument("path", help="NDJSON file, gzipped if it ends in .gz, or - for stdin")
+    parser.add_argument("--source", default="import", help="Name of the system the history comes from")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Records copied per batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    try:
+        stats = await bulk_import(read_file(args.path), args.source, args.batch_size, progress=print_progress)
+    finally:
+        await engine.dispose()
+    print(json.dumps(stats.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+# app/cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+from .metrics import Counter, Gauge
+
+CACHE_HITS = Counter("cache_hits_total", "Cache lookups that found a live entry", ["cache"])
+CACHE_MISSES = Counter("cache_misses_total", "Cache lookups that found nothing or an expired entry", ["cache"])
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries evicted to stay within the size bound", ["cache"])
+CACHE_INVALIDATIONS = Counter("cache_invalidations_total", "Entries removed because their data changed", ["cache"])
+CACHE_SIZE = Gauge("cache_size", "Current weight of the cache (entries or bytes)", ["cache"])
+
+_MISSING = object()
+
+# How many recent invalidations a cache remembers to detect racing loads
+INVALIDATION_HISTORY = 100_000
+
+# Every cache created through LRUCache, for cache_stats()
+CACHES = []
+
+
+class LRUCache:
+    """
+    In-process LRU cache with an optional TTL, bounded by total weight.
+
+    By default every entry weighs 1, so `max_weight` is an entry count; pass a
+    `weigher` to bound it by something else, e.g. bytes. Not shared between
+    worker processes, so the TTL also bounds how stale another worker's
+    writes can look.
+
+    Read-through loads take a token from `begin_load` before reading and pass
+    it to `set`, which then refuses the fill if one of its keys was
+    invalidated after the token was taken: the load may have read the data
+    from before the change that caused the invalidation.
+    """
+
+    def __init__(self, name: str, max_weight: int, ttl: Optional[float] = None, weigher: Callable[[Any], int] = None):
+        self.name = name
+        self.max_weight = max_weight
+        self.ttl = ttl
+        self.weigher = weigher or (lambda value: 1)
+        self.weight = 0
+        # key -> (value, weight, expires_at)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Loads are numbered by invalidations: key -> sequence of its latest invalidation
+        self._sequence = 0
+        self._invalidated_at: "OrderedDict[Hashable, int]" = OrderedDict()
+        # Tokens older than this may have missed invalidations no longer remembered
+        self._forgotten_before = 0
+        CACHES.append(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            CACHE_MISSES.inc(cache=self.name)
+            return default
+        value, weight, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            CACHE_MISSES.inc(cache=self.name)
+            return default
+        self._entries.move_to_end(key)
+        CACHE_HITS.inc(cache=self.name)
+        return value
+
+    def peek(self, key: Hashable, default=None):
+        """
+        Returns a live entry without counting a hit or refreshing its recency.
+        """
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or (entry[2] is not None and entry[2] <= time.monotonic()):
+            return default
+        return entry[0]
+
+    def begin_load(self) -> int:
+        """
+        Returns a token to pass to `set` or `set_many` for values about to be read from the database.
+        """
+        return self._sequence
+
+    def is_stale(self, key: Hashable, token: int) -> bool:
+        return token < self._forgotten_before or self._invalidated_at.get(key, -1) > token
+
+    def set_many(self, entries: dict, token: Optional[int] = None):
+        """
+        Stores all of `entries`, or none if any of their keys is stale for `token`.
+        """
+        if token is not None and any(self.is_stale(key, token) for key in entries):
+            return
+        for key, value in entries.items():
+            self.set(key, value)
+
+    def set(self, key: Hashable, value, token: Optional[int] = None):
+        if token is not None and self.is_stale(key, token):
+            return
+        weight = self.weigher(value)
+        if key in self._entries:
+            self._remove(key)
+        if weight > self.max_weight:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, weight, expires_at)
+        self.weight += weight
+        while self.weight > self.max_weight:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            CACHE_EVICTIONS.inc(cache=self.name)
+        CACHE_SIZE.set(self.weight, cache=self.name)
+
+    def invalidate(self, key: Hashable):
+        self._sequence += 1
+        self._invalidated_at[key] = self._sequence
+        self._invalidated_at.move_to_end(key)
+        if len(self._invalidated_at) > INVALIDATION_HISTORY:
+            _, sequence = self._invalidated_at.popitem(last=False)
+            self._forgotten_before = max(self._forgotten_before, sequence)
+        if key in self._entries:
+            self._remove(key)
+            CACHE_INVALIDATIONS.inc(cache=self.name)
+            CACHE_SIZE.set(self.weight, cache=self.name)
+
+    def clear(self):
+        # Loads in flight may have read data from before whatever prompted the clear
+        self._sequence += 1
+        self._forgotten_before = self._sequence
+        self._entries.clear()
+        self.weight = 0
+        CACHE_SIZE.set(0, cache=self.name)
+
+    def _remove(self, key: Hashable):
+        _, weight, _ = self._entries.pop(key)
+        self.weight -= weight
+
+
+def cache_stats() -> dict:
+    """
+    Returns size and hit statistics for every cache of this process.
+    """
+    stats = {}
+    for cache in CACHES:
+        hits = CACHE_HITS.value(cache=cache.name)
+        misses = CACHE_MISSES.value(cache=cache.name)
+        stats[cache.name] = {
+            "entries": len(cache),
+            "weight": cache.weight,
+            "max_weight": cache.max_weight,
+            "hits": hits,
+            "misses": misses,
+            "evictions": CACHE_EVICTIONS.value(cache=cache.name),
+            "invalidations": CACHE_INVALIDATIONS.value(cache=cache.name),
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+        }
+    return stats
@@ -0,0 +1,71 @@
+# app/conversation_cache.py
+import json
+import os
+from dataclasses import dataclass
+from typing import Any
+from .cache import LRUCache, CACHE_HITS, CACHE_MISSES
+from .metrics import Gauge
+
+CONVERSATION_CACHE_BYTES = int(os.environ.get("CONVERSATION_CACHE_BYTES", str(64 * 1024 * 1024)))
+CONVERSATION_CACHE_TTL = float(os.environ.get("CONVERSATION_CACHE_TTL", "30"))
+
+
+@dataclass
+class CachedConversation:
+    """
+    A fully resolved conversation: the ConversationType with its messages and
+    elements already built. `size` is the length of its JSON serialization
+    and is what the cache's byte bound counts.
+    """
+    conversation: Any
+    size: int
+
+
+conversation_cache = LRUCache(
+    "conversation", max_weight=CONVERSATION_CACHE_BYTES, ttl=CONVERSATION_CACHE_TTL,
+    weigher=lambda cached: cached.size
+)
+
+HIT_RATE = Gauge(
+    "conversation_cache_hit_ratio", "Share of Query.conversation calls served from the cache",
+    function=lambda: hit_rate() or 0.0
+)
+
+
+def enabled() -> bool:
+    return conversation_cache.max_weight > 0
+
+
+def payload_size(payload) -> int:
+    return len(json.dumps(payload, default=str))
+
+
+def begin_load() -> int:
+    """
+    Returns a token to pass to `store` so a load that raced with a mutation
+    does not cache what it read before the mutation committed.
+    """
+    return conversation_cache.begin_load()
+
+
+def get(conversation_id: int):
+    cached = conversation_cache.get(int(conversation_id))
+    return cached.conversation if cached is not None else None
+
+
+def store(conversation_id: int, conversation, size: int, token: int):
+    conversation_cache.set(int(conversation_id), CachedConversation(conversation=conversation, size=size), token=token)
+
+
+def invalidate(conversation_id) -> None:
+    """
+    Drops a conversation's cached payload. Every mutation that changes a
+    conversation, its messages or its elements must call this after committing.
+    """
+    conversation_cache.invalidate(int(conversation_id))
+
+
+def hit_rate():
+    hits = CACHE_HITS.value(cache=conversation_cache.name)
+    misses = CACHE_MISSES.value(cache=conversation_cache.name)
+    return hits / (hits + misses) if hits + misses else None
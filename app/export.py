@@ -0,0 +1,185 @@
+# app/export.py
+"""
+Streaming NDJSON export of conversations with their messages and elements.
+
+    GET /api/export?username=alice&since=2024-01-01T00:00:00Z&gzip=true
+
+Each line is one JSON object whose "record" is user, conversation, message,
+element, cursor or end; the other keys are the row's columns (so an
+element's own `type` stays untouched). Records of a conversation are
+followed by a cursor record; after a disconnect, passing the last cursor
+seen as `cursor` resumes right after that conversation. The end record
+marks a complete export. Memory use does not depend on the export size:
+conversations are read in keyset pages and messages through a server-side
+cursor.
+"""
+import json
+import uuid
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from dateutil import parser
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+from sqlalchemy.future import select
+from .database import engine
+from .metrics import Counter
+from .models import Conversation, Element, Message, User
+from .users import get_user_by_username
+from .utilities import decode_cursor, encode_cursor
+
+# Conversations per keyset page, and message rows fetched per round trip
+EXPORT_PAGE_SIZE = 100
+EXPORT_YIELD_PER = 1000
+
+EXPORTED_RECORDS = Counter("export_records_total", "Records written by the NDJSON export", ["type"])
+
+router = APIRouter()
+
+USER_FIELDS = ("id", "username", "createdAt", "role", "image", "provider", "tags")
+CONVERSATION_FIELDS = ("id", "createdAt", "appUserId", "tags")
+MESSAGE_FIELDS = (
+    "id", "conversation_id", "createdAt", "author", "content", "language", "prompt", "parentId", "indent",
+    "isError", "authorIsUser", "disableHumanFeedback", "waitForAnswer", "humanFeedback", "humanFeedbackComment",
+)
+ELEMENT_FIELDS = (
+    "id", "conversation_id", "type", "name", "mime", "url", "display", "language", "size", "object_key", "for_ids",
+)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+def record(record_type: str, row, fields) -> bytes:
+    EXPORTED_RECORDS.inc(type=record_type)
+    payload = {"record": record_type}
+    payload.update((field, getattr(row, field)) for field in fields)
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode() + b"\n"
+
+
+def marker(record_type: str, **values) -> bytes:
+    return json.dumps({"record": record_type, **values}).encode() + b"\n"
+
+
+def decode_export_cursor(cursor: str):
+    try:
+        created_at, conversation_id = decode_cursor(cursor)
+        return parser.isoparse(created_at), int(conversation_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor.")
+
+
+async def export_records(
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yields the export as NDJSON lines, one page of conversations at a time.
+    """
+    after = decode_export_cursor(cursor) if cursor else None
+    while True:
+        query = (
+            select(*(getattr(Conversation, field) for field in CONVERSATION_FIELDS))
+            .where(Conversation.deletedAt.is_(None))
+            .order_by(Conversation.createdAt, Conversation.id)
+            .limit(EXPORT_PAGE_SIZE)
+        )
+        if user_id is not None:
+            query = query.where(Conversation.appUserId == user_id)
+        if since is not None:
+            query = query.where(Conversation.createdAt >= since)
+        if until is not None:
+            query = query.where(Conversation.createdAt < until)
+        if after is not None:
+            query = query.where(tuple_(Conversation.createdAt, Conversation.id) > tuple_(*after))
+
+        chunk = []
+        async with engine.connect() as conn:
+            conversations = (await conn.execute(query)).all()
+            if not conversations:
+                break
+            page_ids = [conversation.id for conversation in conversations]
+            # Users of this page; a user may repeat on later pages, importers skip duplicates
+            user_ids = {conversation.appUserId for conversation in conversations} - {None}
+            users = await conn.execute(
+                select(*(getattr(User, field) for field in USER_FIELDS)).where(User.id.in_(user_ids)).order_by(User.id)
+            )
+            for user in users:
+                chunk.append(record("user", user, USER_FIELDS))
+            elements = {}
+            for element in await conn.execute(
+                select(*(getattr(Element, field) for field in ELEMENT_FIELDS)).where(Element.conversation_id.in_(page_ids))
+            ):
+                elements.setdefault(element.conversation_id, []).append(element)
+
+            # Messages of the whole page arrive in page order through one server-side cursor
+            messages = await conn.stream(
+                select(*(getattr(Message, field) for field in MESSAGE_FIELDS))
+                .join(Conversation, Message.conversation_id == Conversation.id)
+                .where(Message.conversation_id.in_(page_ids))
+                .order_by(Conversation.createdAt, Conversation.id, Message.createdAt, Message.id)
+                .execution_options(yield_per=EXPORT_YIELD_PER)
+            )
+            message = await anext(messages, None)
+            for conversation in conversations:
+                chunk.append(record("conversation", conversation, CONVERSATION_FIELDS))
+                while message is not None and message.conversation_id == conversation.id:
+                    chunk.append(record("message", message, MESSAGE_FIELDS))
+                    if len(chunk) >= EXPORT_YIELD_PER:
+                        yield b"".join(chunk)
+                        chunk = []
+                    message = await anext(messages, None)
+                for element in elements.pop(conversation.id, ()):
+                    chunk.append(record("element", element, ELEMENT_FIELDS))
+                chunk.append(marker("cursor", cursor=encode_cursor(conversation.createdAt, conversation.id)))
+            await messages.close()
+        yield b"".join(chunk)
+        last = conversations[-1]
+        after = (last.createdAt, last.id)
+    yield marker("end")
+
+
+async def gzip_stream(lines: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Gzips a byte stream, flushing after every chunk so the client keeps
+    receiving complete records while the export runs.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in lines:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@router.get("/api/export")
+async def export(
+    username: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="Only conversations created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only conversations created before this time"),
+    cursor: Optional[str] = Query(None, description="Resume after the conversation of this cursor record"),
+    gzip: bool = False,
+):
+    user_id = None
+    if username is not None:
+        user = await get_user_by_username(username)
+        if user is None:
+            raise HTTPException(404, f"User '{username}' does not exist.")
+        user_id = user.id
+    if cursor is not None:
+        try:
+            decode_export_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    body = export_records(user_id=user_id, since=since, until=until, cursor=cursor)
+    headers = {}
+    if gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
@@ -0,0 +1,145 @@
+# app/feedback_stats.py
+"""
+Per-conversation and per-user message and feedback totals.
+
+conversation_feedback_stats and user_feedback_stats are kept up to date by
+statement-level triggers on message and conversation (migrations 6 and 7), in the
+transaction of every write: create_message and the write-behind and bulk
+paths add messages, set_human_feedback moves feedback, delete_message and
+delete_conversation take totals out. Reading them is one primary key lookup.
+
+A message written while its conversation is being deleted can leave that
+user's totals off by the message. Rebuilding recomputes the totals from
+message and fixes only the rows that drifted:
+
+    python -m app.feedback_stats rebuild
+"""
+import argparse
+import asyncio
+import json
+import logging
+from sqlalchemy import text
+from .database import engine
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+STATS_COLUMNS = ("message_count", "feedback_count", "feedback_sum", "positive_count", "negative_count")
+
+FEEDBACK_STATS_DRIFT = Counter("feedback_stats_drift_total", "Stats rows corrected by a rebuild", ["table"])
+
+# STATS_COLUMNS over the messages `m` of a group
+MESSAGE_TOTALS = """
+count(*) AS message_count, count(m."humanFeedback") AS feedback_count,
+coalesce(sum(m."humanFeedback"), 0) AS feedback_sum,
+count(*) FILTER (WHERE m."humanFeedback" > 0) AS positive_count,
+count(*) FILTER (WHERE m."humanFeedback" < 0) AS negative_count
+"""
+FRESH_CONVERSATION_STATS = f"""
+CREATE TEMPORARY TABLE fresh_conversation_stats ON COMMIT DROP AS
+SELECT m.conversation_id, {MESSAGE_TOTALS}
+FROM message m
+JOIN conversation c ON c.id = m.conversation_id AND c."deletedAt" IS NULL
+GROUP BY m.conversation_id
+"""
+FRESH_USER_STATS = """
+CREATE TEMPORARY TABLE fresh_user_stats ON COMMIT DROP AS
+SELECT c."appUserId" AS app_user_id, sum(s.message_count) AS message_count, sum(s.feedback_count) AS feedback_count,
+       sum(s.feedback_sum) AS feedback_sum, sum(s.positive_count) AS positive_count,
+       sum(s.negative_count) AS negative_count
+FROM fresh_conversation_stats s
+JOIN conversation c ON c.id = s.conversation_id
+WHERE c."appUserId" IS NOT NULL
+GROUP BY c."appUserId"
+"""
+# Rows left at zero by deletes are correct and stay
+REMOVE_STALE = """
+DELETE FROM {table} s
+WHERE NOT EXISTS (SELECT 1 FROM {fresh} f WHERE f.{key} = s.{key})
+  AND (s.message_count, s.feedback_count, s.feedback_sum, s.positive_count, s.negative_count) <> (0, 0, 0, 0, 0)
+"""
+# Only rows whose totals differ are written, so the row count is the drift
+UPSERT_FRESH = """
+INSERT INTO {table} AS s ({key}, {columns})
+SELECT {key}, {columns} FROM {fresh}
+ON CONFLICT ({key}) DO UPDATE SET {assignments}
+WHERE ({stored}) IS DISTINCT FROM ({excluded})
+"""
+
+# Takes the messages of `table`, a copy of message about to be dropped, out of the totals
+FORGET_MESSAGES = f"""
+WITH delta AS (
+    SELECT m.conversation_id, c."appUserId" AS app_user_id, {MESSAGE_TOTALS}
+    FROM {{table}} m
+    JOIN conversation c ON c.id = m.conversation_id AND c."deletedAt" IS NULL
+    GROUP BY m.conversation_id, c."appUserId"
+), by_conversation AS (
+    UPDATE conversation_feedback_stats s SET {", ".join(f"{column} = s.{column} - d.{column}" for column in STATS_COLUMNS)}
+    FROM delta d
+    WHERE s.conversation_id = d.conversation_id
+)
+UPDATE user_feedback_stats s SET {", ".join(f"{column} = s.{column} - d.{column}" for column in STATS_COLUMNS)}
+FROM (
+    SELECT app_user_id, {", ".join(f"sum({column}) AS {column}" for column in STATS_COLUMNS)}
+    FROM delta
+    GROUP BY app_user_id
+) d
+WHERE s.app_user_id = d.app_user_id
+"""
+
+
+async def forget_messages(conn, table: str):
+    """
+    Subtracts the messages of `table` from the totals, for messages that
+    leave the database without a DELETE on message, such as a detached
+    partition. Runs on `conn` so it commits together with the detach.
+    """
+    await conn.execute(text(FORGET_MESSAGES.format(table=table)))
+
+
+async def rebuild() -> dict:
+    """
+    Recomputes both stats tables from message and returns how many rows of
+    each were wrong. Writes to message wait until the rebuild commits.
+    """
+    drift = {}
+    async with engine.begin() as conn:
+        # The triggers of concurrent writes need these locks, so no change slips between scan and fix
+        await conn.execute(text("LOCK TABLE conversation_feedback_stats, user_feedback_stats IN EXCLUSIVE MODE"))
+        await conn.execute(text(FRESH_CONVERSATION_STATS))
+        await conn.execute(text(FRESH_USER_STATS))
+        for table, fresh, key in (
+            ("conversation_feedback_stats", "fresh_conversation_stats", "conversation_id"),
+            ("user_feedback_stats", "fresh_user_stats", "app_user_id"),
+        ):
+            removed = await conn.execute(text(REMOVE_STALE.format(table=table, fresh=fresh, key=key)))
+            upserted = await conn.execute(text(UPSERT_FRESH.format(
+                table=table, fresh=fresh, key=key,
+                columns=", ".join(STATS_COLUMNS),
+                assignments=", ".join(f"{column} = EXCLUDED.{column}" for column in STATS_COLUMNS),
+                stored=", ".join(f"s.{column}" for column in STATS_COLUMNS),
+                excluded=", ".join(f"EXCLUDED.{column}" for column in STATS_COLUMNS),
+            )))
+            drift[table] = removed.rowcount + upserted.rowcount
+            FEEDBACK_STATS_DRIFT.inc(drift[table], table=table)
+    if any(drift.values()):
+        logger.warning("Corrected drifted feedback stats: %s", drift)
+    return drift
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain the feedback stats tables.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recompute the totals from message and fix rows that drifted")
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        drift = await rebuild()
+    finally:
+        await engine.dispose()
+    print(json.dumps(drift, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# app/ingest.py
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from .database import async_session
+from .models import Message
+from .utilities import parse_created_at
+
+
+def message_row(
+    id,
+    author,
+    content,
+    conversationId,
+    createdAt=None,
+    language=None,
+    prompt=None,
+    isError=False,
+    parentId=None,
+    indent=0,
+    authorIsUser=False,
+    disableHumanFeedback=False,
+    waitForAnswer=False,
+) -> dict:
+    """
+    Validates create_message style arguments and converts them into a Message row.
+    Raises ValueError for malformed ids or dates.
+    """
+    row = dict(
+        id=uuid.UUID(str(id)),
+        content=content,
+        isError=isError,
+        conversation_id=int(conversationId),
+        author=author,
+        language=language,
+        prompt=prompt,
+        parentId=uuid.UUID(str(parentId)) if parentId else None,
+        indent=indent,
+        authorIsUser=authorIsUser,
+        disableHumanFeedback=disableHumanFeedback,
+        waitForAnswer=waitForAnswer,
+    )
+    created_at = parse_created_at(createdAt)
+    # Stamped here rather than by the column default, so the row published to
+    # subscribers carries the createdAt that is stored. Naive values are local
+    # time, as asyncpg reads them.
+    row["createdAt"] = created_at.astimezone(timezone.utc) if created_at is not None else datetime.now(timezone.utc)
+    return row
+
+
+async def insert_messages(rows: List[dict]) -> List[Optional[str]]:
+    """
+    Inserts message rows in a single transaction and returns one error (or None)
+    per row.
+
+    The happy path is one executemany. If the batch violates a constraint it is
+    rolled back and replayed row by row inside savepoints, so a bad row only
+    fails itself. Other errors (e.g. a lost connection) propagate.
+    """
+    if not rows:
+        return []
+    async with async_session() as session:
+        try:
+            await session.execute(insert(Message), rows)
+            await session.commit()
+            return [None] * len(rows)
+        except (IntegrityError, DataError):
+            await session.rollback()
+
+        errors = []
+        for row in rows:
+            try:
+                async with session.begin_nested():
+                    await session.execute(insert(Message), [row])
+                errors.append(None)
+            except (IntegrityError, DataError) as e:
+                # Prefer the driver's own message over SQLAlchemy's wrapper
+                errors.append(str(e.orig.__cause__ or e.orig))
+        await session.commit()
+        return errors
@@ -0,0 +1,181 @@
+# app/instrumentation.py
+import os
+import time
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+from inspect import isawaitable
+from typing import Optional
+from sqlalchemy import event
+from strawberry.extensions import SchemaExtension
+from strawberry.extensions.tracing.utils import should_skip_tracing
+from .database import engine
+from .metrics import Counter, Histogram
+
+# Raise when one GraphQL operation runs more SQL statements than this (0 disables).
+# Meant for tests and CI, where it turns N+1 regressions into failures.
+SQL_STATEMENT_BUDGET = int(os.environ.get("SQL_STATEMENT_BUDGET", "0"))
+# Requests with this header get their SQL accounting in the response extensions
+DEBUG_SQL_HEADER = "x-debug-sql"
+
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+DB_STATEMENT_SECONDS = Histogram("db_statement_seconds", "Time spent executing one SQL statement")
+DB_ROWS = Counter("db_rows_total", "Rows returned or affected by SQL statements")
+RESOLVER_SECONDS = Histogram("graphql_resolver_seconds", "Wall time of a GraphQL resolver", ["field"])
+RESOLVER_DB_SECONDS = Histogram("graphql_resolver_db_seconds", "Time a GraphQL resolver spent in SQL statements", ["field"])
+RESOLVER_ROWS = Histogram("graphql_resolver_rows", "Rows a GraphQL resolver read or wrote", ["field"], buckets=ROW_BUCKETS)
+
+
+class QueryStats:
+    """
+    SQL work attributed to the code running in the current context. Statements
+    are also added to every `parent`, so a resolver's work counts towards the
+    operation that contains it.
+    """
+    __slots__ = ("statements", "db_seconds", "rows", "parent", "statement_counts")
+
+    def __init__(self, parent: Optional["QueryStats"] = None, count_statements: bool = False):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.parent = parent
+        # SQL text -> executions, kept only where repeated statements are reported
+        self.statement_counts = StatementCounter() if count_statements else None
+
+    def record(self, statement: str, seconds: float, rows: int):
+        stats = self
+        while stats is not None:
+            stats.statements += 1
+            stats.db_seconds += seconds
+            stats.rows += rows
+            if stats.statement_counts is not None:
+                stats.statement_counts[statement] += 1
+            stats = stats.parent
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_stats", default=None)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.statement_start = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.statement_start
+    # asyncpg reports -1 for SELECTs, whose rows are already fetched at this point
+    rows = cursor.rowcount if cursor.rowcount >= 0 else len(getattr(cursor, "_rows", None) or ())
+    DB_STATEMENT_SECONDS.observe(elapsed)
+    DB_ROWS.inc(rows)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed, rows)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _handle_error(exception_context):
+    # Failed statements, such as constraint violations mapped to GraphQL errors, are round trips too
+    start = getattr(exception_context.execution_context, "statement_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    DB_STATEMENT_SECONDS.observe(elapsed)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(exception_context.statement, elapsed, 0)
+
+
+class ResolverMetrics(SchemaExtension):
+    """
+    Records the wall time, SQL time and row count of every resolver that is
+    not a plain attribute lookup. DataLoader batches are attributed to the
+    resolver whose load started the batch.
+    """
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        if should_skip_tracing(_next, info):
+            return _next(root, info, *args, **kwargs)
+        field = f"{info.parent_type.name}.{info.field_name}"
+        stats = QueryStats(parent=current_stats.get())
+        start = time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            result = _next(root, info, *args, **kwargs)
+        except Exception:
+            self._observe(field, start, stats)
+            raise
+        finally:
+            current_stats.reset(token)
+        if not isawaitable(result):
+            self._observe(field, start, stats)
+            return result
+        return self._await(result, field, start, stats)
+
+    async def _await(self, result, field, start, stats):
+        token = current_stats.set(stats)
+        try:
+            return await result
+        finally:
+            current_stats.reset(token)
+            self._observe(field, start, stats)
+
+    @staticmethod
+    def _observe(field: str, start: float, stats: QueryStats):
+        RESOLVER_SECONDS.observe(time.perf_counter() - start, field=field)
+        RESOLVER_DB_SECONDS.observe(stats.db_seconds, field=field)
+        RESOLVER_ROWS.observe(stats.rows, field=field)
+
+
+class StatementBudgetExceeded(AssertionError):
+    """Raised when an operation runs more statements than SQL_STATEMENT_BUDGET."""
+
+
+class SQLAccounting(SchemaExtension):
+    """
+    Counts the SQL statements, SQL time and rows of each GraphQL operation.
+
+    The totals are returned under `extensions.sql` when the request has an
+    X-Debug-SQL header, together with statements that ran more than once
+    (the signature of an N+1 query). With SQL_STATEMENT_BUDGET set, an
+    operation that exceeds the budget raises StatementBudgetExceeded.
+    """
+
+    def on_operation(self):
+        self.debug = _has_debug_header(self.execution_context.context)
+        self.stats = QueryStats(parent=current_stats.get(), count_statements=self.debug or SQL_STATEMENT_BUDGET > 0)
+        token = current_stats.set(self.stats)
+        try:
+            yield
+        finally:
+            current_stats.reset(token)
+        if SQL_STATEMENT_BUDGET and self.stats.statements > SQL_STATEMENT_BUDGET:
+            raise StatementBudgetExceeded(
+                f"Operation {self.execution_context.operation_name or '(anonymous)'} ran "
+                f"{self.stats.statements} SQL statements, budget is {SQL_STATEMENT_BUDGET}. "
+                f"Repeated: {self._repeated()}"
+            )
+
+    def get_results(self):
+        if not self.debug:
+            return {}
+        return {
+            "sql": {
+                "statements": self.stats.statements,
+                "dbMs": round(self.stats.db_seconds * 1000, 3),
+                "rows": self.stats.rows,
+                "repeated": self._repeated(),
+            }
+        }
+
+    def _repeated(self):
+        return [
+            {"statement": statement, "count": count}
+            for statement, count in self.stats.statement_counts.most_common()
+            if count > 1
+        ]
+
+
+def _has_debug_header(context) -> bool:
+    request = context.get("request") if isinstance(context, dict) else getattr(context, "request", None)
+    return request is not None and DEBUG_SQL_HEADER in request.headers
@@ -0,0 +1,254 @@
+# app/limits.py
+"""
+Per-role limits on GraphQL operations.
+
+The role of a request comes from its X-API-Key header through API_KEY_ROLES
+(a JSON object mapping keys to roles); requests without a known key get
+DEFAULT_ROLE. Every role has a RoleLimits, overridable through ROLE_LIMITS,
+e.g. '{"USER": {"maxCost": 2000, "concurrency": 8}}'.
+
+QueryLimits rejects operations deeper than `max_depth` or with an estimated
+cost above `max_cost` before they run, and lets at most `concurrency`
+operations of a role execute at once in each worker. Operations that do not
+get a slot within `queue_timeout` seconds fail fast with HTTP 503 instead of
+piling up on the connection pool.
+"""
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode, IntValueNode, VariableNode,
+    get_named_type, get_nullable_type, is_list_type,
+)
+from graphql import ExecutionResult as GraphQLExecutionResult
+from strawberry.extensions import SchemaExtension
+from .metrics import Counter, Gauge, Histogram
+
+
+@dataclass(frozen=True)
+class RoleLimits:
+    max_depth: int
+    max_cost: int
+    # Operations executing at once per worker, and how long others wait for a slot
+    concurrency: int
+    queue_timeout: float
+
+
+# A conversation node with appUser, messages and elements costs 62 (see README), so
+# a full conversations page (MAX_PAGE_SIZE 100) costs 6301 and a default page of 20 costs 1261
+DEFAULT_ROLE_LIMITS = {
+    "ANONYMOUS": RoleLimits(max_depth=8, max_cost=2000, concurrency=2, queue_timeout=1.0),
+    "USER": RoleLimits(max_depth=10, max_cost=10000, concurrency=10, queue_timeout=2.0),
+    "ADMIN": RoleLimits(max_depth=15, max_cost=50000, concurrency=15, queue_timeout=5.0),
+    "OWNER": RoleLimits(max_depth=15, max_cost=50000, concurrency=15, queue_timeout=5.0),
+}
+# ROLE_LIMITS keys -> RoleLimits fields
+_LIMIT_KEYS = {"maxDepth": "max_depth", "maxCost": "max_cost", "concurrency": "concurrency", "queueTimeout": "queue_timeout"}
+
+
+def load_role_limits(overrides: Optional[str]) -> Dict[str, RoleLimits]:
+    limits = dict(DEFAULT_ROLE_LIMITS)
+    for role, values in json.loads(overrides or "{}").items():
+        unknown = set(values) - set(_LIMIT_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown ROLE_LIMITS keys for {role}: {sorted(unknown)}")
+        base = limits.get(role, limits["USER"])
+        limits[role] = replace(base, **{_LIMIT_KEYS[key]: value for key, value in values.items()})
+    return limits
+
+
+ROLE_LIMITS = load_role_limits(os.environ.get("ROLE_LIMITS"))
+API_KEY_ROLES: Dict[str, str] = json.loads(os.environ.get("API_KEY_ROLES", "{}"))
+DEFAULT_ROLE = os.environ.get("DEFAULT_ROLE", "USER")
+API_KEY_HEADER = "x-api-key"
+
+# Items assumed for list fields without a registered size or `first` argument
+DEFAULT_LIST_SIZE = 10
+# "Type.field" -> (items when `first` is not given, largest `first` the resolver honours)
+LIST_SIZES: Dict[str, Tuple[int, int]] = {}
+
+LIMIT_REJECTIONS = Counter("graphql_limit_rejections_total", "Operations rejected by the role limits", ["role", "reason"])
+OPERATION_COST = Histogram(
+    "graphql_operation_cost", "Estimated cost of admitted operations", ["role"],
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+)
+SLOT_WAIT_SECONDS = Histogram("graphql_slot_wait_seconds", "Time operations waited for an execution slot", ["role"])
+
+_slots: Dict[str, asyncio.Semaphore] = {}
+IN_FLIGHT = Gauge("graphql_operations_in_flight", "Operations executing, by role", ["role"])
+
+
+def role_limits(role: str) -> RoleLimits:
+    return ROLE_LIMITS.get(role, ROLE_LIMITS[DEFAULT_ROLE])
+
+
+def request_role(context) -> str:
+    request = context.get("request") if isinstance(context, dict) else getattr(context, "request", None)
+    api_key = request.headers.get(API_KEY_HEADER) if request is not None else None
+    return API_KEY_ROLES.get(api_key, DEFAULT_ROLE) if api_key else DEFAULT_ROLE
+
+
+class CostEstimator:
+    """
+    Estimates depth and cost of an operation from its selection. Every field
+    with a selection costs 1; list fields multiply their own cost by the
+    number of items, taken from `first` (also on the connection field above
+    them) or LIST_SIZES. Scalars and introspection are free.
+    """
+
+    def __init__(self, schema, fragments, variables):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables or {}
+
+    def field_nodes(self, selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from self.field_nodes(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is not None:
+                    yield from self.field_nodes(fragment.selection_set)
+
+    def first_argument(self, node: FieldNode) -> Optional[int]:
+        for argument in node.arguments:
+            if argument.name.value != "first":
+                continue
+            value = None
+            if isinstance(argument.value, IntValueNode):
+                value = int(argument.value.value)
+            elif isinstance(argument.value, VariableNode):
+                value = self.variables.get(argument.value.name.value)
+            # A negative `first` would lower the cost of the fields next to it
+            return value if isinstance(value, int) and value > 0 else None
+        return None
+
+    def estimate(self, parent_type, selection_set, page_size: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Returns (depth, cost) of a selection set on `parent_type`.
+        """
+        depth = cost = 0
+        for node in self.field_nodes(selection_set):
+            name = node.name.value
+            if name.startswith("__"):
+                continue
+            field = parent_type.fields.get(name)
+            if field is None:
+                continue
+            if node.selection_set is None:
+                depth = max(depth, 1)
+                continue
+            key = f"{parent_type.name}.{name}"
+            first = self.first_argument(node)
+            default_size, max_size = LIST_SIZES.get(key, (DEFAULT_LIST_SIZE, None))
+            if first is not None and max_size is not None:
+                first = min(first, max_size)
+            if is_list_type(get_nullable_type(field.type)):
+                items = first or page_size or default_size
+                child_page_size = None
+            else:
+                items = 1
+                # A connection field's `first` sizes the list below it
+                child_page_size = first or (default_size if key in LIST_SIZES else page_size)
+            child_depth, child_cost = self.estimate(get_named_type(field.type), node.selection_set, child_page_size)
+            depth = max(depth, child_depth + 1)
+            cost += items * (1 + child_cost)
+        return depth, cost
+
+
+def estimate_operation(schema, document, operation_name, variables) -> Tuple[int, int]:
+    fragments = {}
+    operation = None
+    for definition in document.definitions:
+        if definition.kind == "fragment_definition":
+            fragments[definition.name.value] = definition
+        elif definition.kind == "operation_definition":
+            if operation_name is None or (definition.name and definition.name.value == operation_name):
+                operation = operation or definition
+    if operation is None:
+        return 0, 0
+    root_type = schema.get_root_type(operation.operation)
+    return CostEstimator(schema, fragments, variables).estimate(root_type, operation.selection_set)
+
+
+def _slot(role: str, limits: RoleLimits) -> asyncio.Semaphore:
+    if role not in _slots:
+        _slots[role] = asyncio.Semaphore(limits.concurrency)
+    return _slots[role]
+
+
+class QueryLimits(SchemaExtension):
+    """
+    Enforces the depth, cost and concurrency limits of the requesting role.
+    """
+
+    def on_validate(self):
+        # Runs before validation: errors set here skip validation and fail the
+        # operation, and oversized documents are turned away before validating them
+        self._check_cost()
+        yield
+
+    def _check_cost(self):
+        execution_context = self.execution_context
+        if execution_context.graphql_document is None:
+            return
+        self.role = request_role(execution_context.context)
+        limits = role_limits(self.role)
+        depth, cost = estimate_operation(
+            execution_context.schema._schema, execution_context.graphql_document,
+            execution_context.operation_name, execution_context.variables
+        )
+        if depth > limits.max_depth:
+            LIMIT_REJECTIONS.inc(role=self.role, reason="depth")
+            execution_context.errors = [GraphQLError(
+                f"Query depth {depth} exceeds the limit of {limits.max_depth}.",
+                extensions={"code": "QUERY_TOO_DEEP", "depth": depth, "maxDepth": limits.max_depth}
+            )]
+        elif cost > limits.max_cost:
+            LIMIT_REJECTIONS.inc(role=self.role, reason="cost")
+            execution_context.errors = [GraphQLError(
+                f"Query cost {cost} exceeds the limit of {limits.max_cost}.",
+                extensions={"code": "QUERY_TOO_COSTLY", "cost": cost, "maxCost": limits.max_cost}
+            )]
+        else:
+            OPERATION_COST.observe(cost, role=self.role)
+
+    async def on_execute(self):
+        execution_context = self.execution_context
+        role = getattr(self, "role", None) or request_role(execution_context.context)
+        limits = role_limits(role)
+        slot = _slot(role, limits)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(slot.acquire(), limits.queue_timeout)
+        except asyncio.TimeoutError:
+            SLOT_WAIT_SECONDS.observe(time.perf_counter() - start, role=role)
+            LIMIT_REJECTIONS.inc(role=role, reason="busy")
+            self._reject_busy(limits)
+            yield
+            return
+        SLOT_WAIT_SECONDS.observe(time.perf_counter() - start, role=role)
+        IN_FLIGHT.inc(role=role)
+        try:
+            yield
+        finally:
+            IN_FLIGHT.dec(role=role)
+            slot.release()
+
+    def _reject_busy(self, limits: RoleLimits):
+        execution_context = self.execution_context
+        # Setting the result before execution makes strawberry skip executing the operation
+        execution_context.result = GraphQLExecutionResult(data=None, errors=[GraphQLError(
+            "The server is busy; retry later.",
+            extensions={"code": "SERVICE_UNAVAILABLE", "retryAfter": max(1, round(limits.queue_timeout))}
+        )])
+        context = execution_context.context
+        response = context.get("response") if isinstance(context, dict) else getattr(context, "response", None)
+        if response is not None:
+            response.status_code = 503
+            response.headers["Retry-After"] = str(max(1, round(limits.queue_timeout)))
@@ -0,0 +1,102 @@
+# app/loaders.py
+from collections import defaultdict
+from functools import partial
+from typing import List, Tuple
+from strawberry.dataloader import DataLoader
+from sqlalchemy.future import select
+from .database import async_session
+from .models import Message, Element
+from .write_behind import message_buffer
+from .users import get_users_by_ids
+
+
+async def load_messages(columns: Tuple, conversation_ids: List[int]):
+    """
+    Loads the messages of every requested conversation with a single IN (...) query,
+    fetching only `columns` (which must include conversation_id, id and createdAt)
+    as plain rows. Messages still waiting in the write-behind buffer are merged in.
+    """
+    # Taken before the query: a row whose batch commits after it is then in one of the two
+    pending = {conversation_id: message_buffer.pending_for(conversation_id) for conversation_id in conversation_ids}
+    async with async_session() as session:
+        result = await session.execute(
+            select(*columns)
+            .where(Message.conversation_id.in_(conversation_ids))
+            .order_by(Message.createdAt.asc())
+        )
+        messages = defaultdict(list)
+        for message in result:
+            messages[message.conversation_id].append(message)
+    for conversation_id in conversation_ids:
+        if pending[conversation_id]:
+            # A row can briefly be both committed and pending while its batch finishes
+            merged = {message.id: message for message in messages[conversation_id]}
+            for message in pending[conversation_id]:
+                merged.setdefault(message.id, message)
+            messages[conversation_id] = sorted(merged.values(), key=lambda message: message.createdAt)
+    return [messages[conversation_id] for conversation_id in conversation_ids]
+
+
+async def load_elements(columns: Tuple, conversation_ids: List[int]):
+    """
+    Loads the elements of every requested conversation with a single IN (...) query,
+    fetching only `columns` (which must include conversation_id) as plain rows.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(*columns).where(Element.conversation_id.in_(conversation_ids))
+        )
+        elements = defaultdict(list)
+        for element in result:
+            elements[element.conversation_id].append(element)
+    return [elements[conversation_id] for conversation_id in conversation_ids]
+
+
+class Loaders:
+    """
+    DataLoaders scoped to a single GraphQL request, so batching and caching
+    never leak between requests. There is one loader per relationship and
+    column projection; sibling nodes share a selection, so in practice that is
+    still one query per level.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+
+    def _get(self, load_fn, columns) -> DataLoader:
+        key = (load_fn, tuple(str(column) for column in columns))
+        if key not in self._loaders:
+            self._loaders[key] = DataLoader(load_fn=partial(load_fn, tuple(columns)))
+        return self._loaders[key]
+
+    def messages(self, columns) -> DataLoader:
+        return self._get(load_messages, columns)
+
+    def elements(self, columns) -> DataLoader:
+        return self._get(load_elements, columns)
+
+    def users(self) -> DataLoader:
+        # Users are small and served from the user cache, so they are not projected
+        if "users" not in self._loaders:
+            self._loaders["users"] = DataLoader(load_fn=get_users_by_ids)
+        return self._loaders["users"]
+
+
+async def get_context():
+    """
+    Context getter for the GraphQLRouter; creates fresh loaders for every request.
+    """
+    return {"loaders": Loaders()}
+
+
+def get_loaders(info) -> Loaders:
+    """
+    Returns the request's loaders. Callers that execute the schema directly with
+    a dict context get loaders created on first use.
+    """
+    context = info.context
+    if isinstance(context, dict):
+        return context.setdefault("loaders", Loaders())
+    if context is not None and hasattr(context, "loaders"):
+        return context.loaders
+    return Loaders()
@@ -0,0 +1,157 @@
+# app/metrics.py
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Every metric created through this module, in creation order
+REGISTRY: List["Metric"] = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    Base class for the in-process metrics. Values are kept per label tuple;
+    label values are passed as keyword arguments in the order of `labelnames`.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Yields (name suffix, label pairs, value) for the exposition format.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", tuple(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Gauges created with `function` are read
+    from it when collected instead of being set explicitly.
+    """
+    type = "gauge"
+
+    def __init__(self, name, description, labelnames=(), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            yield "", (), self._function()
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label tuple -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(self._key(labels))
+        return int(sum(counts[:-1])) if counts else 0
+
+    def sum(self, **labels) -> float:
+        counts = self._values.get(self._key(labels))
+        return counts[-1] if counts else 0.0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                yield "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield "_sum", labels, counts[-1]
+            yield "_count", labels, cumulative
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples():
+            label_text = ",".join(f'{name}="{_escape(str(label))}"' for name, label in labels)
+            name = metric.name + suffix + (f"{{{label_text}}}" if label_text else "")
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,43 @@
+# app/migrate.py
+"""
+Applies schema migrations ahead of a deploy.
+
+    python -m app.migrate status
+    python -m app.migrate upgrade [--target VERSION]
+"""
+import argparse
+import asyncio
+import logging
+from .database import engine
+from .migrations import current_version, describe, load_migrations, upgrade
+
+
+async def status():
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    for migration in load_migrations():
+        state = "applied" if migration.VERSION <= version else "pending"
+        print(f"{migration.VERSION:04d}  {state:8}  {describe(migration)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage the database schema version.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="List migrations and whether they are applied")
+    upgrade_parser = subparsers.add_parser("upgrade", help="Apply pending migrations")
+    upgrade_parser.add_argument("--target", type=int, default=None, help="Stop after this version")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        if args.command == "status":
+            await status()
+        else:
+            applied = await upgrade(engine, target=args.target)
+            print(f"Applied {len(applied)} migration(s)" + (f": {applied}" if applied else ""))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
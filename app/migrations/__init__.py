@@ -0,0 +1,135 @@
+# app/migrations/__init__.py
+"""
+Versioned schema migrations.
+
+Each `vNNNN_<name>.py` module in this package defines VERSION, TRANSACTIONAL and
+a list of SQL STATEMENTS. Transactional migrations run in one transaction
+together with their schema_version row. The others run statement by statement
+in autocommit mode, which CREATE INDEX CONCURRENTLY needs. Their statements
+must be idempotent (IF NOT EXISTS), so a run interrupted halfway can be retried.
+A concurrent build that failed leaves an invalid index behind, which IF NOT
+EXISTS would keep, so such leftovers are dropped before the index is built again.
+"""
+import importlib
+import logging
+import pkgutil
+import re
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Serializes migration runs across processes and hosts
+MIGRATION_LOCK_ID = 0x6368_6174
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+# Index names of CREATE INDEX CONCURRENTLY statements, quoted or not
+CONCURRENT_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+("[^"]+"|\w+)', re.IGNORECASE)
+INVALID_INDEX = "SELECT EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid)"
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised at startup when the database schema is behind this build."""
+
+
+def load_migrations():
+    """
+    Returns the migration modules of this package ordered by VERSION.
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        if module_info.name.startswith("v"):
+            migrations.append(importlib.import_module(f"{__name__}.{module_info.name}"))
+    migrations.sort(key=lambda migration: migration.VERSION)
+    versions = [migration.VERSION for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1].VERSION if migrations else 0
+
+
+def describe(migration) -> str:
+    return (migration.__doc__ or migration.__name__).strip().splitlines()[0]
+
+
+async def current_version(conn) -> int:
+    """
+    Returns the schema version recorded in the database, 0 if never migrated.
+    """
+    exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+
+async def check_schema_version(engine):
+    """
+    Fails fast when the database has not been migrated to this build's version.
+    Used at startup instead of creating tables.
+    """
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    expected = latest_version()
+    if version < expected:
+        raise SchemaVersionError(
+            f"Database schema is at version {version} but this build needs {expected}. "
+            "Run `python -m app.migrate upgrade` before starting the server."
+        )
+
+
+async def drop_invalid_index(conn, statement: str):
+    """
+    Drops the index `statement` builds concurrently if an earlier, failed
+    build left it behind as invalid.
+    """
+    match = CONCURRENT_INDEX.match(statement.strip())
+    if match is None:
+        return
+    name = match.group(1)
+    if await conn.scalar(text(INVALID_INDEX), {"name": name}):
+        logger.warning("Dropping invalid index %s left by an interrupted build", name)
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+async def upgrade(engine, target: int = None) -> list:
+    """
+    Applies every pending migration up to `target` (default: latest) and
+    returns the versions applied.
+    """
+    applied = []
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            await lock_conn.execute(text(SCHEMA_VERSION_DDL))
+            version = await current_version(lock_conn)
+            for migration in load_migrations():
+                if migration.VERSION <= version or (target is not None and migration.VERSION > target):
+                    continue
+                logger.info("Applying migration %s: %s", migration.VERSION, describe(migration))
+                record = text("INSERT INTO schema_version (version, description) VALUES (:version, :description)")
+                params = {"version": migration.VERSION, "description": describe(migration)}
+                if migration.TRANSACTIONAL:
+                    async with engine.begin() as conn:
+                        for statement in migration.STATEMENTS:
+                            await conn.execute(text(statement))
+                        await conn.execute(record, params)
+                else:
+                    for statement in migration.STATEMENTS:
+                        await drop_invalid_index(lock_conn, statement)
+                        await lock_conn.execute(text(statement))
+                    await lock_conn.execute(record, params)
+                applied.append(migration.VERSION)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return applied
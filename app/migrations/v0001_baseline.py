@@ -0,0 +1,70 @@
+"""Baseline schema, as previously built by Base.metadata.create_all on startup."""
+
+VERSION = 1
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS app_user (
+        id SERIAL NOT NULL,
+        username VARCHAR(50) NOT NULL,
+        "createdAt" TIMESTAMP WITH TIME ZONE,
+        role VARCHAR(50) NOT NULL,
+        image VARCHAR(255),
+        provider VARCHAR(50),
+        tags JSONB NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (username)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversation (
+        id SERIAL NOT NULL,
+        "createdAt" TIMESTAMP WITH TIME ZONE,
+        "isError" BOOLEAN,
+        "appUserId" INTEGER,
+        tags JSONB NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY("appUserId") REFERENCES app_user (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS element (
+        id UUID NOT NULL,
+        conversation_id INTEGER,
+        type VARCHAR NOT NULL,
+        name VARCHAR NOT NULL,
+        mime VARCHAR,
+        url VARCHAR,
+        display VARCHAR,
+        language VARCHAR,
+        size VARCHAR,
+        object_key VARCHAR,
+        for_ids JSONB,
+        PRIMARY KEY (id),
+        FOREIGN KEY(conversation_id) REFERENCES conversation (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS message (
+        id UUID NOT NULL,
+        content VARCHAR NOT NULL,
+        "createdAt" TIMESTAMP WITH TIME ZONE,
+        "isError" BOOLEAN,
+        author VARCHAR,
+        language VARCHAR,
+        prompt JSONB,
+        "parentId" UUID,
+        indent INTEGER,
+        "authorIsUser" BOOLEAN,
+        "disableHumanFeedback" BOOLEAN,
+        "waitForAnswer" BOOLEAN,
+        conversation_id INTEGER,
+        "humanFeedback" INTEGER,
+        "humanFeedbackComment" VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY("parentId") REFERENCES message (id),
+        FOREIGN KEY(conversation_id) REFERENCES conversation (id)
+    )
+    """,
+]
@@ -0,0 +1,12 @@
+"""Generated tsvector column over message content for full-text search."""
+
+VERSION = 2
+TRANSACTIONAL = True
+
+# Adding a stored generated column rewrites the message table once
+STATEMENTS = [
+    """
+    ALTER TABLE message ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR
+        GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+    """,
+]
@@ -0,0 +1,18 @@
+"""Indexes used by the conversation and message resolvers, built without blocking writes."""
+
+VERSION = 3
+# CREATE INDEX CONCURRENTLY cannot run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_conversation_createdAt_id" '
+    'ON conversation ("createdAt" DESC, id DESC)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_conversation_appUserId_createdAt" '
+    'ON conversation ("appUserId", "createdAt")',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_message_conversation_id_createdAt" '
+    'ON message (conversation_id, "createdAt")',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_message_content_tsv '
+    'ON message USING gin (content_tsv)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_message_conversation_id_feedback '
+    'ON message (conversation_id, "humanFeedback") WHERE "humanFeedback" IS NOT NULL',
+]
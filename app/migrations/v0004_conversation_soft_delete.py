@@ -0,0 +1,15 @@
+"""Soft-delete column for conversations and the indexes the background purge relies on."""
+
+VERSION = 4
+# CREATE INDEX CONCURRENTLY cannot run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    # Nullable without a default, so adding it does not rewrite the table
+    'ALTER TABLE conversation ADD COLUMN IF NOT EXISTS "deletedAt" TIMESTAMP WITH TIME ZONE',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_conversation_deletedAt" '
+    'ON conversation ("deletedAt") WHERE "deletedAt" IS NOT NULL',
+    # Foreign key checks on message deletes look up replies by parentId
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_message_parentId" ON message ("parentId")',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_element_conversation_id ON element (conversation_id)',
+]
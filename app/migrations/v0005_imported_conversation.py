@@ -0,0 +1,18 @@
+"""Maps conversation ids of imported histories to the ids they were given here."""
+
+VERSION = 5
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS imported_conversation (
+        source VARCHAR(100) NOT NULL,
+        source_id INTEGER NOT NULL,
+        conversation_id INTEGER NOT NULL,
+        PRIMARY KEY (source, source_id),
+        FOREIGN KEY(conversation_id) REFERENCES conversation (id) ON DELETE CASCADE
+    )
+    """,
+    # Foreign key checks when the purge deletes conversations
+    'CREATE INDEX IF NOT EXISTS ix_imported_conversation_conversation_id ON imported_conversation (conversation_id)',
+]
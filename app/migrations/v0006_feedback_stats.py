@@ -0,0 +1,146 @@
+"""Per-conversation and per-user feedback totals, kept up to date by triggers on message and conversation."""
+
+VERSION = 6
+TRANSACTIONAL = True
+
+STATS_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    {key} INTEGER PRIMARY KEY REFERENCES {parent} (id) ON DELETE CASCADE,
+    message_count BIGINT NOT NULL DEFAULT 0,
+    feedback_count BIGINT NOT NULL DEFAULT 0,
+    feedback_sum BIGINT NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0
+)
+"""
+
+# Adds the signed changes of `rows` (conversation_id, sign, feedback) to both
+# tables in one statement. Messages of deleted conversations no longer count.
+# Upserts go in key order so concurrent statements lock rows in the same order.
+APPLY_CHANGES = """
+        WITH delta AS (
+            SELECT changed.conversation_id, c."appUserId" AS app_user_id,
+                   sum(sign) AS message_count,
+                   sum(sign) FILTER (WHERE feedback IS NOT NULL) AS feedback_count,
+                   sum(sign * feedback) AS feedback_sum,
+                   sum(sign) FILTER (WHERE feedback > 0) AS positive_count,
+                   sum(sign) FILTER (WHERE feedback < 0) AS negative_count
+            FROM ({rows}) AS changed
+            JOIN conversation c ON c.id = changed.conversation_id AND c."deletedAt" IS NULL
+            GROUP BY changed.conversation_id, c."appUserId"
+        ), by_conversation AS (
+            INSERT INTO conversation_feedback_stats AS s
+                (conversation_id, message_count, feedback_count, feedback_sum, positive_count, negative_count)
+            SELECT conversation_id, message_count, coalesce(feedback_count, 0), coalesce(feedback_sum, 0),
+                   coalesce(positive_count, 0), coalesce(negative_count, 0)
+            FROM delta
+            ORDER BY conversation_id
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                message_count = s.message_count + EXCLUDED.message_count,
+                feedback_count = s.feedback_count + EXCLUDED.feedback_count,
+                feedback_sum = s.feedback_sum + EXCLUDED.feedback_sum,
+                positive_count = s.positive_count + EXCLUDED.positive_count,
+                negative_count = s.negative_count + EXCLUDED.negative_count
+        )
+        INSERT INTO user_feedback_stats AS s
+            (app_user_id, message_count, feedback_count, feedback_sum, positive_count, negative_count)
+        SELECT app_user_id, sum(message_count), coalesce(sum(feedback_count), 0), coalesce(sum(feedback_sum), 0),
+               coalesce(sum(positive_count), 0), coalesce(sum(negative_count), 0)
+        FROM delta
+        WHERE app_user_id IS NOT NULL
+        GROUP BY app_user_id
+        ORDER BY app_user_id
+        ON CONFLICT (app_user_id) DO UPDATE SET
+            message_count = s.message_count + EXCLUDED.message_count,
+            feedback_count = s.feedback_count + EXCLUDED.feedback_count,
+            feedback_sum = s.feedback_sum + EXCLUDED.feedback_sum,
+            positive_count = s.positive_count + EXCLUDED.positive_count,
+            negative_count = s.negative_count + EXCLUDED.negative_count;
+"""
+INSERTED = 'SELECT conversation_id, 1 AS sign, "humanFeedback" AS feedback FROM new_rows'
+DELETED = 'SELECT conversation_id, -1 AS sign, "humanFeedback" AS feedback FROM old_rows'
+# Updates that change neither feedback nor conversation cancel out in the sums
+UPDATED = f"""{INSERTED} UNION ALL {DELETED}"""
+
+STATEMENTS = [
+    STATS_TABLE.format(table="conversation_feedback_stats", key="conversation_id", parent="conversation"),
+    STATS_TABLE.format(table="user_feedback_stats", key="app_user_id", parent="app_user"),
+    f"""
+    CREATE OR REPLACE FUNCTION message_feedback_stats() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {APPLY_CHANGES.format(rows=INSERTED)}
+        ELSIF TG_OP = 'DELETE' THEN
+            {APPLY_CHANGES.format(rows=DELETED)}
+        ELSE
+            {APPLY_CHANGES.format(rows=UPDATED)}
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    # Statement-level triggers with transition tables run once per statement,
+    # so batched inserts update each stats row once
+    'DROP TRIGGER IF EXISTS message_feedback_stats_insert ON message',
+    'CREATE TRIGGER message_feedback_stats_insert AFTER INSERT ON message '
+    'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION message_feedback_stats()',
+    'DROP TRIGGER IF EXISTS message_feedback_stats_update ON message',
+    'CREATE TRIGGER message_feedback_stats_update AFTER UPDATE ON message '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION message_feedback_stats()',
+    'DROP TRIGGER IF EXISTS message_feedback_stats_delete ON message',
+    'CREATE TRIGGER message_feedback_stats_delete AFTER DELETE ON message '
+    'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION message_feedback_stats()',
+    # Deleting a conversation takes its totals out of its user's
+    """
+    CREATE OR REPLACE FUNCTION conversation_feedback_stats() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH deleted AS (
+            DELETE FROM conversation_feedback_stats s
+            USING old_rows o, new_rows n
+            WHERE o.id = n.id AND o."deletedAt" IS NULL AND n."deletedAt" IS NOT NULL AND s.conversation_id = n.id
+            RETURNING n."appUserId" AS app_user_id, s.*
+        )
+        UPDATE user_feedback_stats u SET
+            message_count = u.message_count - d.message_count,
+            feedback_count = u.feedback_count - d.feedback_count,
+            feedback_sum = u.feedback_sum - d.feedback_sum,
+            positive_count = u.positive_count - d.positive_count,
+            negative_count = u.negative_count - d.negative_count
+        FROM (
+            SELECT app_user_id, sum(message_count) AS message_count, sum(feedback_count) AS feedback_count,
+                   sum(feedback_sum) AS feedback_sum, sum(positive_count) AS positive_count,
+                   sum(negative_count) AS negative_count
+            FROM deleted
+            GROUP BY app_user_id
+        ) d
+        WHERE u.app_user_id = d.app_user_id;
+        RETURN NULL;
+    END
+    $$
+    """,
+    'DROP TRIGGER IF EXISTS conversation_feedback_stats_update ON conversation',
+    'CREATE TRIGGER conversation_feedback_stats_update AFTER UPDATE ON conversation '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION conversation_feedback_stats()',
+    # Backfill; the triggers above already block writes to message until this commits
+    'DELETE FROM conversation_feedback_stats',
+    'DELETE FROM user_feedback_stats',
+    """
+    INSERT INTO conversation_feedback_stats
+        (conversation_id, message_count, feedback_count, feedback_sum, positive_count, negative_count)
+    SELECT m.conversation_id, count(*), count(m."humanFeedback"), coalesce(sum(m."humanFeedback"), 0),
+           count(*) FILTER (WHERE m."humanFeedback" > 0), count(*) FILTER (WHERE m."humanFeedback" < 0)
+    FROM message m
+    JOIN conversation c ON c.id = m.conversation_id AND c."deletedAt" IS NULL
+    GROUP BY m.conversation_id
+    """,
+    """
+    INSERT INTO user_feedback_stats
+        (app_user_id, message_count, feedback_count, feedback_sum, positive_count, negative_count)
+    SELECT c."appUserId", sum(s.message_count), sum(s.feedback_count), sum(s.feedback_sum),
+           sum(s.positive_count), sum(s.negative_count)
+    FROM conversation_feedback_stats s
+    JOIN conversation c ON c.id = s.conversation_id
+    WHERE c."appUserId" IS NOT NULL
+    GROUP BY c."appUserId"
+    """,
+]
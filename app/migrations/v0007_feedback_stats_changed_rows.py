@@ -0,0 +1,34 @@
+"""Feedback stats triggers skip message updates that change neither feedback nor conversation."""
+from .v0006_feedback_stats import APPLY_CHANGES, DELETED, INSERTED
+
+VERSION = 7
+TRANSACTIONAL = True
+
+# Transition tables rule out `AFTER UPDATE OF <columns>`, so the trigger still fires on
+# every update, but rows whose feedback and conversation are unchanged (such as streamed
+# content edits) drop out here, leaving no delta and no stats rows to lock.
+CHANGED_ROWS = """
+old_rows o JOIN new_rows n ON n.id = o.id
+WHERE (o."humanFeedback", o.conversation_id) IS DISTINCT FROM (n."humanFeedback", n.conversation_id)
+"""
+UPDATED = (
+    f'SELECT n.conversation_id, 1 AS sign, n."humanFeedback" AS feedback FROM {CHANGED_ROWS} UNION ALL '
+    f'SELECT o.conversation_id, -1 AS sign, o."humanFeedback" AS feedback FROM {CHANGED_ROWS}'
+)
+
+STATEMENTS = [
+    f"""
+    CREATE OR REPLACE FUNCTION message_feedback_stats() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {APPLY_CHANGES.format(rows=INSERTED)}
+        ELSIF TG_OP = 'DELETE' THEN
+            {APPLY_CHANGES.format(rows=DELETED)}
+        ELSE
+            {APPLY_CHANGES.format(rows=UPDATED)}
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+]
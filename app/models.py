@@ -1,14 +1,17 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean, Index, Computed
+from sqlalchemy.orm import relationship, deferred
 from .database import Base
-from sqlalchemy.dialects.postgresql import JSONB  # If you're using PostgreSQL
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR  # If you're using PostgreSQL
 from sqlalchemy import desc 
 import time
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from sqlalchemy.sql import func
 
+# Text search configuration used to index and query Message.content
+SEARCH_CONFIG = 'english'
+
 
 class User(Base):
     __tablename__ = 'app_user'
@@ -41,6 +44,11 @@ class Element(Base):
     # depending on your application's requirements.
     for_ids = Column(JSONB, default=list, nullable=True)
 
+    __table_args__ = (
+        # Used by the elements loader and the conversation purge
+        Index('ix_element_conversation_id', 'conversation_id'),
+    )
+
 class Message(Base):
     __tablename__ = 'message'
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)  # Changed to UUID
@@ -50,6 +58,7 @@ class Message(Base):
     author = Column(String, nullable=True)  # Assuming author is a string
     language = Column(String, nullable=True)  # Assuming language is a string
     prompt = Column(JSONB, nullable=True)  # Assuming prompt is a JSON structure
+    # The database drops this foreign key when message is partitioned (app/partitions.py)
     parentId = Column(UUID(as_uuid=True), ForeignKey('message.id'), nullable=True)
     indent = Column(Integer, default=0)
     authorIsUser = Column(Boolean, default=False)
@@ -60,6 +69,20 @@ class Message(Base):
     humanFeedback = Column(Integer, nullable=True)  # Assuming feedback is an integer score
     humanFeedbackComment = Column(String, nullable=True)  # Feedback comment as a string
     disableHumanFeedback = Column(Boolean, default=False)
+    # Generated by Postgres from content, so every insert/update keeps it in sync.
+    # Deferred so regular message loads never pull the vector over the wire.
+    content_tsv = deferred(Column(TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', content)", persisted=True)))
+
+    __table_args__ = (
+        Index('ix_message_content_tsv', 'content_tsv', postgresql_using='gin'),
+        # Only messages that received feedback, for the withFeedback filter
+        Index(
+            'ix_message_conversation_id_feedback', 'conversation_id', 'humanFeedback',
+            postgresql_where=humanFeedback.isnot(None)
+        ),
+        Index('ix_message_conversation_id_createdAt', 'conversation_id', 'createdAt'),
+        Index('ix_message_parentId', 'parentId'),
+    )
 
 class Conversation(Base):
     __tablename__ = 'conversation'
@@ -69,7 +92,59 @@ class Conversation(Base):
     isError = Column(Boolean, default=False)
     appUserId = Column(Integer, ForeignKey('app_user.id'))
     tags = Column(JSONB, default=list, nullable=False)
+    # Set by delete_conversation; the purge worker removes the rows later
+    deletedAt = Column(DateTime(timezone=True), nullable=True)
     # Relationship with User
     appUser = relationship("User", back_populates="conversations")
     elements = relationship("Element", back_populates="conversation")
-    # Add a back_populates in User model for conversation
\ No newline at end of file
+    # Add a back_populates in User model for conversation
+
+    __table_args__ = (
+        # Backs the (createdAt, id) keyset pagination in Query.conversations
+        Index('ix_conversation_createdAt_id', createdAt.desc(), id.desc()),
+        Index('ix_conversation_appUserId_createdAt', appUserId, createdAt),
+        Index('ix_conversation_deletedAt', deletedAt, postgresql_where=deletedAt.isnot(None)),
+    )
+
+
+class ImportedConversation(Base):
+    """
+    Remembers which conversation an imported conversation became, so that
+    re-running an import skips what is already there.
+    """
+    __tablename__ = 'imported_conversation'
+    # Label of the system the history came from; ids are only unique within it
+    source = Column(String(100), primary_key=True)
+    source_id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (
+        Index('ix_imported_conversation_conversation_id', 'conversation_id'),
+    )
+
+
+class ConversationFeedbackStats(Base):
+    """
+    Message and feedback totals of a conversation, maintained by triggers on
+    message and conversation (see migration 6). Deleted conversations have none.
+    """
+    __tablename__ = 'conversation_feedback_stats'
+    conversation_id = Column(Integer, ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    message_count = Column(BigInteger, nullable=False, default=0)
+    feedback_count = Column(BigInteger, nullable=False, default=0)
+    feedback_sum = Column(BigInteger, nullable=False, default=0)
+    positive_count = Column(BigInteger, nullable=False, default=0)
+    negative_count = Column(BigInteger, nullable=False, default=0)
+
+
+class UserFeedbackStats(Base):
+    """
+    Totals of ConversationFeedbackStats over the conversations of a user.
+    """
+    __tablename__ = 'user_feedback_stats'
+    app_user_id = Column(Integer, ForeignKey('app_user.id', ondelete='CASCADE'), primary_key=True)
+    message_count = Column(BigInteger, nullable=False, default=0)
+    feedback_count = Column(BigInteger, nullable=False, default=0)
+    feedback_sum = Column(BigInteger, nullable=False, default=0)
+    positive_count = Column(BigInteger, nullable=False, default=0)
+    negative_count = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,357 @@
+# app/partitions.py
+"""
+Monthly range partitioning of message on "createdAt", with retention.
+
+    python -m app.partitions convert    (once, in a maintenance window)
+    python -m app.partitions maintain   (what the background worker runs)
+    python -m app.partitions status
+
+Partitioning is opt-in. `convert` rebuilds message as a table partitioned
+into message_pYYYY_MM (UTC months) plus message_default for timestamps
+outside every month. It copies the rows while holding an exclusive lock on
+message and recreates the table's indexes, foreign keys and triggers.
+
+Two constraints change with it:
+- A unique key must contain the partition key, so the primary key becomes
+  (id, "createdAt"). Message ids are no longer checked for uniqueness across
+  different timestamps.
+- The "parentId" foreign key is dropped, because it has no unique id left
+  to reference.
+
+A query with a "createdAt" range on message scans only the partitions of
+that range.
+
+PartitionMaintainer keeps MESSAGE_PARTITION_MONTHS_AHEAD months of
+partitions ready. When MESSAGE_RETENTION_MONTHS is set, it also retires
+each older partition:
+1. Detach the partition, taking its messages out of the feedback stats.
+2. Copy it to MESSAGE_ARCHIVE_PATH/<partition>.csv.gz.
+3. Drop it.
+Messages written later for an archived month land in message_default.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+from sqlalchemy import text
+from .database import engine
+from .feedback_stats import forget_messages
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.environ.get("MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+MESSAGE_RETENTION_MONTHS = int(os.environ.get("MESSAGE_RETENTION_MONTHS", "0"))
+MESSAGE_ARCHIVE_PATH = os.environ.get("MESSAGE_ARCHIVE_PATH", "message-archive")
+PARTITION_MAINTENANCE_ENABLED = os.environ.get("PARTITION_MAINTENANCE_ENABLED", "1").lower() in ("1", "true", "yes")
+PARTITION_MAINTENANCE_INTERVAL = float(os.environ.get("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+# Keeps the maintenance of several workers from running at once
+PARTITION_LOCK_ID = 0x6D73_6770
+PARTITION_NAME = re.compile(r"^message_p(\d{4})_(\d{2})$")
+DEFAULT_PARTITION = "message_default"
+
+PARTITION_CHANGES = Counter("message_partitions_total", "Message partitions created and archived", ["action"])
+ARCHIVED_MESSAGES = Counter("message_archived_rows_total", "Messages copied to archive files")
+
+ATTACHED = """
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'message'::regclass
+"""
+# Partitions detached by an archive run that did not get to drop them
+DETACHED = """
+SELECT c.relname FROM pg_class c
+WHERE c.relkind = 'r' AND c.relname ~ '^message_p[0-9]{4}_[0-9]{2}$' AND pg_table_is_visible(c.oid)
+  AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+"""
+STORED_COLUMNS = """
+SELECT column_name FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name = :table AND is_generated = 'NEVER'
+ORDER BY ordinal_position
+"""
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month() -> date:
+    today = datetime.now(timezone.utc).date()
+    return date(today.year, today.month, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"message_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def bound(month: date) -> str:
+    """
+    SQL literal of the start of `month` in UTC, for partition bounds.
+    """
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+async def is_partitioned(conn) -> bool:
+    return bool(await conn.scalar(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('message')")))
+
+
+async def stored_columns(conn, table: str = "message") -> str:
+    """
+    Quoted, comma separated columns of `table` that take values, i.e. all but generated ones.
+    """
+    columns = (await conn.execute(text(STORED_COLUMNS), {"table": table})).scalars().all()
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+async def create_partition(conn, month: date):
+    """
+    Creates the partition of `month`. Rows of that month already in the
+    default partition are moved into it, since the partition cannot be
+    created while the default one holds rows of its range.
+    """
+    columns = await stored_columns(conn)
+    start, end = bound(month), bound(add_months(month, 1))
+    await conn.execute(text(
+        "CREATE TEMPORARY TABLE moved_message ON COMMIT DROP AS SELECT * FROM message WITH NO DATA"
+    ))
+    # Through message, not message_default, so the feedback stats triggers see the move
+    moved = await conn.exec_driver_sql(
+        f'WITH moved AS (DELETE FROM message WHERE "createdAt" >= {start} AND "createdAt" < {end} '
+        f'RETURNING {columns}) INSERT INTO moved_message ({columns}) SELECT {columns} FROM moved'
+    )
+    await conn.exec_driver_sql(
+        f"CREATE TABLE {partition_name(month)} PARTITION OF message FOR VALUES FROM ({start}) TO ({end})"
+    )
+    if moved.rowcount:
+        await conn.execute(text(f"INSERT INTO message ({columns}) SELECT {columns} FROM moved_message"))
+        logger.info("Moved %s messages from %s into %s", moved.rowcount, DEFAULT_PARTITION, partition_name(month))
+    await conn.execute(text("DROP TABLE moved_message"))
+    PARTITION_CHANGES.inc(action="created")
+
+
+async def convert(months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD) -> dict:
+    """
+    Turns message into a partitioned table in one transaction. Returns the
+    partitions created and the number of messages copied.
+    """
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            raise RuntimeError("message is already partitioned.")
+        await conn.execute(text("LOCK TABLE message IN ACCESS EXCLUSIVE MODE"))
+        indexes = (await conn.execute(text(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = 'message' AND indexname <> 'message_pkey'"
+        ))).scalars().all()
+        # The "parentId" foreign key references message itself and is left out
+        foreign_keys = (await conn.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'message'::regclass AND contype = 'f' AND confrelid <> conrelid"
+        ))).all()
+        triggers = (await conn.execute(text(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = 'message'::regclass AND NOT tgisinternal"
+        ))).scalars().all()
+        months = set((await conn.execute(text(
+            """SELECT DISTINCT date_trunc('month', "createdAt" AT TIME ZONE 'UTC')::date FROM message"""
+            ' WHERE "createdAt" IS NOT NULL'
+        ))).scalars().all())
+        months.update(add_months(current_month(), offset) for offset in range(months_ahead + 1))
+
+        await conn.execute(text("ALTER TABLE message RENAME TO message_unpartitioned"))
+        await conn.execute(text(
+            'CREATE TABLE message (LIKE message_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED) '
+            'PARTITION BY RANGE ("createdAt")'
+        ))
+        await conn.execute(text(
+            'ALTER TABLE message ALTER COLUMN "createdAt" SET DEFAULT now(), ALTER COLUMN "createdAt" SET NOT NULL'
+        ))
+        await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF message DEFAULT"))
+        for month in sorted(months):
+            await conn.exec_driver_sql(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF message "
+                f"FOR VALUES FROM ({bound(month)}) TO ({bound(add_months(month, 1))})"
+            )
+        columns = await stored_columns(conn, "message_unpartitioned")
+        # The partition key cannot be NULL; such rows sort last, so they become the newest
+        selected = columns.replace('"createdAt"', 'coalesce("createdAt", now())')
+        copied = await conn.execute(text(f"INSERT INTO message ({columns}) SELECT {selected} FROM message_unpartitioned"))
+        await conn.execute(text("DROP TABLE message_unpartitioned"))
+        # Indexes are built after loading, once per partition
+        await conn.execute(text('ALTER TABLE message ADD PRIMARY KEY (id, "createdAt")'))
+        # Replayed as the catalog wrote them, without bind parameter parsing
+        for index in indexes:
+            await conn.exec_driver_sql(index)
+        for name, definition in foreign_keys:
+            await conn.exec_driver_sql(f'ALTER TABLE message ADD CONSTRAINT "{name}" {definition}')
+        for trigger in triggers:
+            await conn.exec_driver_sql(trigger)
+    PARTITION_CHANGES.inc(len(months), action="created")
+    return {"partitions": [partition_name(month) for month in sorted(months)], "messages": copied.rowcount}
+
+
+async def archive_partition(name: str, attached: bool = True) -> int:
+    """
+    Detaches the partition `name`, writes it to a gzipped CSV file in
+    MESSAGE_ARCHIVE_PATH and drops it. Returns the number of archived
+    messages. A partition detached by an earlier, interrupted run is
+    archived with `attached=False`.
+    """
+    if attached:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE message DETACH PARTITION {name}"))
+            await forget_messages(conn, name)
+    os.makedirs(MESSAGE_ARCHIVE_PATH, exist_ok=True)
+    path = os.path.join(MESSAGE_ARCHIVE_PATH, f"{name}.csv.gz")
+    partial = path + ".partial"
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        with gzip.open(partial, "wb") as archive_file:
+            async def write(data):
+                await asyncio.to_thread(archive_file.write, data)
+            status = await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+            await asyncio.to_thread(archive_file.flush)
+            await asyncio.to_thread(os.fsync, archive_file.fileobj.fileno())
+        # Only a complete archive takes the final name, and only then is the data dropped
+        os.replace(partial, path)
+        await conn.execute(text(f"DROP TABLE {name}"))
+        await conn.commit()
+    rows = int(status.split()[-1])
+    ARCHIVED_MESSAGES.inc(rows)
+    PARTITION_CHANGES.inc(action="archived")
+    logger.info("Archived %s messages of %s to %s", rows, name, path)
+    return rows
+
+
+async def maintain(
+    months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD, retention_months: int = MESSAGE_RETENTION_MONTHS
+) -> dict:
+    """
+    Creates missing partitions up to `months_ahead` months from now and
+    archives those older than `retention_months` months (0 keeps all).
+    Does nothing unless message is partitioned or while another worker
+    maintains the partitions.
+    """
+    done = {"created": [], "archived": []}
+    async with engine.connect() as lock_conn:
+        if not await is_partitioned(lock_conn):
+            return done
+        if not await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": PARTITION_LOCK_ID}):
+            return done
+        try:
+            attached = set((await lock_conn.execute(text(ATTACHED))).scalars().all())
+            detached = (await lock_conn.execute(text(DETACHED))).scalars().all()
+            await lock_conn.commit()
+            this_month = current_month()
+            for offset in range(months_ahead + 1):
+                month = add_months(this_month, offset)
+                if partition_name(month) not in attached:
+                    async with engine.begin() as conn:
+                        await create_partition(conn, month)
+                    done["created"].append(partition_name(month))
+            for name in detached:
+                await archive_partition(name, attached=False)
+                done["archived"].append(name)
+            if retention_months > 0:
+                cutoff = add_months(this_month, -retention_months)
+                for name in sorted(attached):
+                    month = partition_month(name)
+                    if month is not None and month < cutoff:
+                        await archive_partition(name)
+                        done["archived"].append(name)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": PARTITION_LOCK_ID})
+            await lock_conn.commit()
+    return done
+
+
+async def partition_status() -> List[dict]:
+    """
+    Lists the partitions of message with their bounds and estimated row counts.
+    """
+    async with engine.connect() as conn:
+        if not await is_partitioned(conn):
+            return []
+        rows = await conn.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'message'::regclass ORDER BY c.relname"
+        ))
+        return [
+            {"partition": name, "bounds": bounds, "estimated_rows": max(int(estimate), 0)}
+            for name, bounds, estimate in rows
+        ]
+
+
+class PartitionMaintainer:
+    """
+    Background worker that runs `maintain` every `interval` seconds. Every
+    worker process can run one; an advisory lock lets one at a time work.
+    """
+
+    def __init__(self, enabled: bool = PARTITION_MAINTENANCE_ENABLED, interval: float = PARTITION_MAINTENANCE_INTERVAL):
+        self.enabled = enabled
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                done = await maintain()
+                if done["created"] or done["archived"]:
+                    logger.info("Maintained message partitions", extra=done)
+            except Exception:
+                logger.exception("Maintaining message partitions failed")
+            await asyncio.sleep(self.interval)
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the message table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Partition the message table by month (locks it while copying)")
+    convert_parser.add_argument("--months-ahead", type=int, default=MESSAGE_PARTITION_MONTHS_AHEAD)
+    maintain_parser = subparsers.add_parser("maintain", help="Create upcoming partitions and archive expired ones")
+    maintain_parser.add_argument("--months-ahead", type=int, default=MESSAGE_PARTITION_MONTHS_AHEAD)
+    maintain_parser.add_argument("--retention-months", type=int, default=MESSAGE_RETENTION_MONTHS)
+    subparsers.add_parser("status", help="List partitions with estimated row counts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        if args.command == "convert":
+            result = await convert(args.months_ahead)
+        elif args.command == "maintain":
+            result = await maintain(args.months_ahead, args.retention_months)
+        else:
+            result = await partition_status()
+    finally:
+        await engine.dispose()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,232 @@
+# app/persisted_queries.py
+"""
+Automatic persisted queries (APQ), an operation allowlist and a cache of
+parsed and validated documents.
+
+Clients following the Apollo APQ protocol send only
+`extensions.persistedQuery.sha256Hash`; the server answers with a
+PersistedQueryNotFound error until the client has sent the full query with
+its hash once. Operations listed in PERSISTED_QUERIES_FILE are known from
+startup, and with PERSISTED_QUERIES_ONLY=1 nothing else is executed.
+"""
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from graphql import DocumentNode, GraphQLError, parse, specified_rules
+from strawberry.extensions import SchemaExtension
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.subscriptions.protocols.graphql_ws import GQL_ERROR
+from strawberry.schema.execute import validate_document
+from strawberry.types import ExecutionResult
+from .cache import LRUCache
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PERSISTED_QUERIES_FILE = os.environ.get("PERSISTED_QUERIES_FILE")
+PERSISTED_QUERIES_ONLY = os.environ.get("PERSISTED_QUERIES_ONLY", "0").lower() in ("1", "true", "yes")
+PERSISTED_QUERY_CACHE_SIZE = int(os.environ.get("PERSISTED_QUERY_CACHE_SIZE", "10000"))
+DOCUMENT_CACHE_SIZE = int(os.environ.get("DOCUMENT_CACHE_SIZE", "1000"))
+
+PERSISTED_QUERY_LOOKUPS = Counter(
+    "persisted_query_lookups_total", "Requests that referenced a persisted query, by outcome", ["outcome"]
+)
+
+# sha256 hash -> query text of the operations registered by clients through APQ
+apq_store = LRUCache("persisted_query", max_weight=PERSISTED_QUERY_CACHE_SIZE)
+# query text -> CachedDocument
+document_cache = LRUCache("document", max_weight=DOCUMENT_CACHE_SIZE)
+
+
+@dataclass
+class CachedDocument:
+    document: DocumentNode
+    # Validation rules the document passed; None until it has been validated
+    validated_rules: Optional[Tuple] = None
+
+
+class PersistedQueryError(Exception):
+    """A persisted query request that cannot be served, with its APQ error code."""
+
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class Registry:
+    """
+    Allowlisted operations by sha256 hash, loaded once at startup.
+    """
+
+    def __init__(self):
+        self.queries: Dict[str, str] = {}
+
+    def __contains__(self, sha256_hash: str) -> bool:
+        return sha256_hash in self.queries
+
+    def get(self, sha256_hash: str) -> Optional[str]:
+        return self.queries.get(sha256_hash)
+
+    def load(self, path: str, schema=None) -> int:
+        """
+        Reads an Apollo persisted query manifest, or a JSON object mapping
+        hashes to queries. With `schema`, every operation is also parsed and
+        validated into the document cache, so bad entries fail the startup.
+        """
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if isinstance(manifest, dict) and "operations" in manifest:
+            entries = {operation["id"]: operation["body"] for operation in manifest["operations"]}
+        else:
+            entries = manifest
+        for sha256_hash, query in entries.items():
+            if query_hash(query) != sha256_hash:
+                raise ValueError(f"Persisted query {sha256_hash} in {path} does not match its hash.")
+            if schema is not None:
+                cached = cached_document(query)
+                rules = tuple(specified_rules)
+                errors = validate_document(schema._schema, cached.document, rules)
+                if errors:
+                    raise ValueError(f"Persisted query {sha256_hash} in {path} is invalid: {errors[0].message}")
+                cached.validated_rules = rules
+            self.queries[sha256_hash] = query
+        logger.info("Loaded %s persisted queries from %s", len(entries), path)
+        return len(entries)
+
+
+registry = Registry()
+
+
+def cached_document(query: str) -> CachedDocument:
+    cached = document_cache.get(query)
+    if cached is None:
+        cached = CachedDocument(document=parse(query))
+        document_cache.set(query, cached)
+    return cached
+
+
+def resolve_query(query: Optional[str], extensions: Optional[dict]) -> Optional[str]:
+    """
+    Returns the query text to execute for a request, registering APQ queries.
+    """
+    persisted = (extensions or {}).get("persistedQuery")
+    if not persisted:
+        if PERSISTED_QUERIES_ONLY and query and query_hash(query) not in registry:
+            PERSISTED_QUERY_LOOKUPS.inc(outcome="rejected")
+            raise PersistedQueryError("PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED")
+        return query
+    sha256_hash = persisted.get("sha256Hash")
+    if persisted.get("version") != 1 or not isinstance(sha256_hash, str):
+        raise PersistedQueryError("Unsupported persisted query version", "PERSISTED_QUERY_NOT_SUPPORTED")
+    if query is None:
+        query = registry.get(sha256_hash) or apq_store.get(sha256_hash)
+        if query is None:
+            PERSISTED_QUERY_LOOKUPS.inc(outcome="miss")
+            raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+        PERSISTED_QUERY_LOOKUPS.inc(outcome="hit")
+        return query
+    if query_hash(query) != sha256_hash:
+        raise PersistedQueryError("provided sha does not match query", "PERSISTED_QUERY_HASH_MISMATCH")
+    if sha256_hash not in registry:
+        if PERSISTED_QUERIES_ONLY:
+            PERSISTED_QUERY_LOOKUPS.inc(outcome="rejected")
+            raise PersistedQueryError("PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED")
+        apq_store.set(sha256_hash, query)
+        PERSISTED_QUERY_LOOKUPS.inc(outcome="registered")
+    return query
+
+
+class PersistedQueryTransportWSHandler(GraphQLRouter.graphql_transport_ws_handler_class):
+    async def handle_subscribe(self, message):
+        try:
+            message.payload.query = resolve_query(message.payload.query, message.payload.extensions)
+        except PersistedQueryError as e:
+            await self.close(code=4400, reason=str(e))
+            return
+        await super().handle_subscribe(message)
+
+
+class PersistedQueryWSHandler(GraphQLRouter.graphql_ws_handler_class):
+    async def handle_start(self, message):
+        payload = message["payload"]
+        try:
+            payload["query"] = resolve_query(payload.get("query"), payload.get("extensions"))
+        except PersistedQueryError as e:
+            await self.send_message(GQL_ERROR, message["id"], {"message": str(e), "extensions": {"code": e.code}})
+            return
+        await super().handle_start(message)
+
+
+class PersistedQueryRouter(GraphQLRouter):
+    """
+    GraphQLRouter that resolves `extensions.persistedQuery` before executing,
+    over HTTP and both WebSocket protocols.
+    """
+
+    graphql_transport_ws_handler_class = PersistedQueryTransportWSHandler
+    graphql_ws_handler_class = PersistedQueryWSHandler
+
+    def should_render_graphql_ide(self, request) -> bool:
+        # A GET with only a persisted query hash is an operation, not a browser visit
+        return "extensions" not in request.query_params and super().should_render_graphql_ide(request)
+
+    async def parse_http_body(self, request) -> GraphQLRequestData:
+        content_type = request.content_type or ""
+        if "application/json" in content_type:
+            data = self.parse_json(await request.get_body())
+        elif request.method == "GET":
+            data = self.parse_query_params(request.query_params)
+        else:
+            # Multipart uploads always carry their query, but the allowlist still applies
+            request_data = await super().parse_http_body(request)
+            request_data.query = resolve_query(request_data.query, None)
+            return request_data
+        extensions = data.get("extensions")
+        if isinstance(extensions, str):
+            extensions = self.parse_json(extensions)
+        return GraphQLRequestData(
+            query=resolve_query(data.get("query"), extensions),
+            variables=data.get("variables"),
+            operation_name=data.get("operationName"),
+        )
+
+    async def execute_operation(self, request, context, root_value) -> ExecutionResult:
+        try:
+            return await super().execute_operation(request, context, root_value)
+        except PersistedQueryError as e:
+            return ExecutionResult(data=None, errors=[GraphQLError(str(e), extensions={"code": e.code})])
+
+
+class DocumentCache(SchemaExtension):
+    """
+    Reuses the parsed document and the validation outcome of query texts seen
+    before, so repeated operations skip parsing and validation. Only passing
+    validation outcomes are remembered.
+    """
+
+    def on_parse(self):
+        execution_context = self.execution_context
+        cached = document_cache.get(execution_context.query)
+        if cached is not None:
+            execution_context.graphql_document = cached.document
+        yield
+        if cached is None and execution_context.graphql_document is not None:
+            document_cache.set(execution_context.query, CachedDocument(document=execution_context.graphql_document))
+
+    def on_validate(self):
+        execution_context = self.execution_context
+        cached = document_cache.peek(execution_context.query)
+        rules = tuple(execution_context.validation_rules)
+        if cached is not None and cached.validated_rules == rules:
+            execution_context.errors = []
+        yield
+        if cached is not None and cached.validated_rules != rules and execution_context.errors == []:
+            cached.validated_rules = rules
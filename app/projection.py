@@ -0,0 +1,107 @@
+# app/projection.py
+from typing import Dict, Iterable, List, Set
+from strawberry.types.nodes import SelectedField
+from .models import Message, Conversation, Element
+
+# GraphQL field name -> columns needed to resolve it. Fields missing from a map
+# (e.g. relationships or constants like metadata) need no column of their own.
+CONVERSATION_COLUMNS = {
+    "id": [Conversation.id],
+    "createdAt": [Conversation.createdAt],
+    "tags": [Conversation.tags],
+    "appUser": [Conversation.appUserId],
+}
+
+MESSAGE_COLUMNS = {
+    "id": [Message.id],
+    "isError": [Message.isError],
+    "parentId": [Message.parentId],
+    "indent": [Message.indent],
+    "author": [Message.author],
+    "content": [Message.content],
+    "waitForAnswer": [Message.waitForAnswer],
+    "humanFeedback": [Message.humanFeedback],
+    "humanFeedbackComment": [Message.humanFeedbackComment],
+    "disableHumanFeedback": [Message.disableHumanFeedback],
+    "language": [Message.language],
+    "prompt": [Message.prompt],
+    "authorIsUser": [Message.authorIsUser],
+    "createdAt": [Message.createdAt],
+}
+
+ELEMENT_COLUMNS = {
+    "id": [Element.id],
+    "conversationId": [Element.conversation_id],
+    "type": [Element.type],
+    "name": [Element.name],
+    "mime": [Element.mime],
+    "url": [Element.url],
+    "display": [Element.display],
+    "language": [Element.language],
+    "size": [Element.size],
+    "forIds": [Element.for_ids],
+    "objectKey": [Element.object_key],
+}
+
+def selected_names(selections) -> Set[str]:
+    """
+    Flattens a strawberry selection list into field names, following fragments.
+    """
+    names = set()
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            names.add(selection.name)
+        else:
+            names |= selected_names(selection.selections)
+    return names
+
+
+def _children(selections, name: str) -> list:
+    children = []
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            if selection.name == name:
+                children.extend(selection.selections)
+        else:
+            children.extend(_children(selection.selections, name))
+    return children
+
+
+def requested_fields(info, *path: str) -> Set[str]:
+    """
+    Returns the field names selected below the current field, optionally
+    descending through `path` (e.g. "edges", "node" for a connection).
+    """
+    selections = []
+    for field in info.selected_fields:
+        selections.extend(field.selections)
+    for name in path:
+        selections = _children(selections, name)
+    return selected_names(selections)
+
+
+def columns_for(fields: Iterable[str], column_map: Dict[str, list], required: Iterable = ()) -> List:
+    """
+    Returns the de-duplicated columns needed for `fields`, plus any `required` ones.
+    """
+    fields = set(fields)
+    columns = list(required)
+    # Walk the map rather than the selection so the generated SQL is stable
+    for field, field_columns in column_map.items():
+        if field not in fields:
+            continue
+        for column in field_columns:
+            if not any(column is existing for existing in columns):
+                columns.append(column)
+    return columns
+
+
+def column_value(row, name: str, convert=None):
+    """
+    Reads a column from an ORM object or a projected row. Columns that were not
+    loaded read as None, which is safe because their fields were not selected.
+    """
+    value = getattr(row, name, None)
+    if value is None or convert is None:
+        return value
+    return convert(value)
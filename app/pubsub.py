@@ -0,0 +1,176 @@
+# app/pubsub.py
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, Optional, Set
+import asyncpg
+from .database import engine
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_BACKEND = os.environ.get("PUBSUB_BACKEND", "local")
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("SUBSCRIBER_QUEUE_SIZE", "100"))
+
+PUBSUB_CHANNEL = "chat_events"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7500
+# Events waiting to be sent with NOTIFY before new ones are dropped
+NOTIFY_OUTBOX_SIZE = 10000
+RECONNECT_DELAY = 1.0
+
+PUBSUB_EVENTS = Counter("pubsub_events_total", "Events published and delivered to subscribers", ["outcome"])
+PUBSUB_SLOW_CONSUMERS = Counter("pubsub_slow_consumers_total", "Subscribers dropped because their queue was full")
+
+
+class SlowConsumerError(Exception):
+    """Raised to a subscriber that fell so far behind that events were dropped."""
+
+
+class Subscriber:
+    """
+    One subscription to a topic, with its own bounded queue.
+    """
+
+    def __init__(self, topic: str, queue_size: int):
+        self.topic = topic
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.dropped = False
+
+    async def get(self) -> dict:
+        if self.dropped:
+            raise SlowConsumerError("Subscriber fell behind and missed events; subscribe again and refetch.")
+        return await self.queue.get()
+
+
+class PubSub:
+    """
+    In-process fan-out of events to subscribers by topic.
+
+    Publishing never waits for subscribers: every subscriber has a queue of
+    `queue_size` events, and one whose queue is full is unsubscribed and gets
+    a SlowConsumerError instead of its next event. Events only reach
+    subscribers of this process; see PostgresPubSub for every worker.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._topics: Dict[str, Set[Subscriber]] = defaultdict(set)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._topics.values())
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topic: str) -> Subscriber:
+        subscriber = Subscriber(topic, self.queue_size)
+        self._topics[topic].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._topics.get(subscriber.topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._topics[subscriber.topic]
+
+    async def publish(self, topic: str, event: dict):
+        PUBSUB_EVENTS.inc(outcome="published")
+        self.deliver(topic, event)
+
+    def deliver(self, topic: str, event: dict):
+        for subscriber in list(self._topics.get(topic, ())):
+            try:
+                subscriber.queue.put_nowait(event)
+                PUBSUB_EVENTS.inc(outcome="delivered")
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+                PUBSUB_SLOW_CONSUMERS.inc()
+
+
+class PostgresPubSub(PubSub):
+    """
+    Fans events out to the subscribers of every worker through Postgres
+    LISTEN/NOTIFY on one dedicated connection per worker.
+
+    Events are sent by a background task, so publishing stays non-blocking.
+    Events that would exceed the NOTIFY payload limit are sent without their
+    "message" key; subscribers then load it themselves. Events published
+    while the connection is down are lost.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE, channel: str = PUBSUB_CHANNEL):
+        super().__init__(queue_size)
+        self.channel = channel
+        self._outbox: asyncio.Queue = asyncio.Queue(NOTIFY_OUTBOX_SIZE)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, topic: str, event: dict):
+        payload = json.dumps({"topic": topic, "event": event}, separators=(",", ":"))
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            compact = {key: value for key, value in event.items() if key != "message"}
+            payload = json.dumps({"topic": topic, "event": compact}, separators=(",", ":"))
+        try:
+            self._outbox.put_nowait(payload)
+            PUBSUB_EVENTS.inc(outcome="published")
+        except asyncio.QueueFull:
+            PUBSUB_EVENTS.inc(outcome="lost")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+            self.deliver(data["topic"], data["event"])
+        except (ValueError, KeyError):
+            logger.warning("Ignoring malformed notification on %s", channel)
+
+    async def _run(self):
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(self.channel, self._on_notify)
+                while True:
+                    payload = await self._outbox.get()
+                    await connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Pub/sub connection failed; reconnecting")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                if connection is not None:
+                    await connection.close()
+
+
+PUBSUB_BACKENDS = {"local": PubSub, "postgres": PostgresPubSub}
+
+if PUBSUB_BACKEND not in PUBSUB_BACKENDS:
+    raise ValueError(f"Unknown PUBSUB_BACKEND '{PUBSUB_BACKEND}'.")
+pubsub = PUBSUB_BACKENDS[PUBSUB_BACKEND]()
+
+PUBSUB_SUBSCRIBERS = Gauge("pubsub_subscribers", "Open subscriptions in this worker", function=pubsub.subscriber_count)
+
+
+def conversation_topic(conversation_id) -> str:
+    return f"conversation:{int(conversation_id)}"
@@ -0,0 +1,186 @@
+# app/purge.py
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+from sqlalchemy import delete, exists, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from .database import async_session
+from .metrics import Counter, Histogram
+from .models import Conversation, Element, Message
+
+logger = logging.getLogger(__name__)
+
+PURGE_ENABLED = os.environ.get("PURGE_ENABLED", "1").lower() in ("1", "true", "yes")
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "1000"))
+PURGE_BATCH_DELAY = float(os.environ.get("PURGE_BATCH_DELAY_MS", "50")) / 1000
+PURGE_IDLE_INTERVAL = float(os.environ.get("PURGE_IDLE_INTERVAL", "5"))
+
+PURGED_ROWS = Counter("purge_rows_total", "Rows removed or detached by the conversation purge", ["table"])
+PURGE_BATCH_SECONDS = Histogram("purge_batch_seconds", "Time spent on one purge batch")
+
+
+class ConversationPurger:
+    """
+    Background worker that removes soft-deleted conversations.
+
+    delete_conversation only sets `deletedAt`, which hides the conversation at
+    once. This worker then deletes its elements, detaches message replies and
+    deletes its messages in batches of `batch_size` rows, one short transaction
+    each, sleeping `batch_delay` seconds in between so it never holds locks for
+    long or saturates the database. The conversation row goes last.
+
+    Batches lock their rows with SKIP LOCKED, so every worker process can run
+    a purger without them blocking each other.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = PURGE_ENABLED,
+        batch_size: int = PURGE_BATCH_SIZE,
+        batch_delay: float = PURGE_BATCH_DELAY,
+        idle_interval: float = PURGE_IDLE_INTERVAL,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.idle_interval = idle_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """
+        Starts purging now instead of at the next idle check.
+        """
+        self._wakeup.set()
+
+    async def purge_batch(self) -> bool:
+        """
+        Purges one batch of the oldest soft-deleted conversation. Returns False
+        when there is nothing left to purge.
+        """
+        async with async_session() as session:
+            conversation_id = await session.scalar(
+                select(Conversation.id)
+                .where(Conversation.deletedAt.isnot(None))
+                .order_by(Conversation.deletedAt, Conversation.id)
+                .limit(1)
+            )
+            if conversation_id is None:
+                return False
+            for table, stmt in self._batch_statements(conversation_id):
+                result = await session.execute(stmt.execution_options(synchronize_session=False))
+                if result.rowcount:
+                    await session.commit()
+                    PURGED_ROWS.inc(result.rowcount, table=table)
+                    return True
+            try:
+                result = await session.execute(
+                    delete(Conversation).where(
+                        Conversation.id == conversation_id,
+                        Conversation.deletedAt.isnot(None),
+                        ~exists().where(Message.conversation_id == conversation_id),
+                        ~exists().where(Element.conversation_id == conversation_id),
+                    ).execution_options(synchronize_session=False)
+                )
+                await session.commit()
+            except IntegrityError:
+                # A row was added to the conversation meanwhile; the next batch removes it
+                await session.rollback()
+                return True
+            PURGED_ROWS.inc(result.rowcount, table="conversation")
+            return True
+
+    def _batch_statements(self, conversation_id: int):
+        """
+        Yields (table, statement) for the purge steps, in order. Replies to the
+        conversation's messages, wherever they live, are detached before
+        messages are deleted, so no batch deletes a message that another
+        message still points to.
+        """
+        def batch(column, *criteria):
+            return (
+                select(column).where(*criteria).limit(self.batch_size).with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+
+        yield "element", delete(Element).where(
+            Element.id.in_(batch(Element.id, Element.conversation_id == conversation_id))
+        )
+        reply, parent = aliased(Message), aliased(Message)
+        replies = (
+            select(reply.id)
+            .join(parent, reply.parentId == parent.id)
+            .where(parent.conversation_id == conversation_id)
+            .limit(self.batch_size)
+            .with_for_update(of=reply, skip_locked=True)
+            .scalar_subquery()
+        )
+        yield "message_reply", update(Message).where(Message.id.in_(replies)).values(parentId=None)
+        yield "message", delete(Message).where(
+            Message.id.in_(batch(Message.id, Message.conversation_id == conversation_id))
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                start = time.perf_counter()
+                more = await self.purge_batch()
+                PURGE_BATCH_SECONDS.observe(time.perf_counter() - start)
+            except Exception:
+                logger.exception("Purging deleted conversations failed")
+                more = False
+            if more:
+                await asyncio.sleep(self.batch_delay)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.idle_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+async def purge_status() -> dict:
+    """
+    Returns what is still waiting to be purged, across all workers, and what
+    this worker has purged since it started.
+    """
+    deleted = select(Conversation.id).where(Conversation.deletedAt.isnot(None))
+    async with async_session() as session:
+        pending = (await session.execute(
+            select(func.count(), func.min(Conversation.deletedAt)).where(Conversation.deletedAt.isnot(None))
+        )).one()
+        pending_messages = await session.scalar(
+            select(func.count()).select_from(Message).where(Message.conversation_id.in_(deleted))
+        )
+        pending_elements = await session.scalar(
+            select(func.count()).select_from(Element).where(Element.conversation_id.in_(deleted))
+        )
+    return {
+        "pending_conversations": pending[0],
+        "pending_messages": pending_messages,
+        "pending_elements": pending_elements,
+        "oldest_deleted_at": pending[1],
+        "purged_conversations": int(PURGED_ROWS.value(table="conversation")),
+        "purged_messages": int(PURGED_ROWS.value(table="message")),
+        "purged_elements": int(PURGED_ROWS.value(table="element")),
+    }
+
+
+conversation_purger = ConversationPurger()
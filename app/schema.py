@@ -1,24 +1,44 @@
 # app/schema.py
-import datetime
 import strawberry
-from typing import Any, List, Union, Optional
-from .models import User, Message, Conversation, Element
+from typing import List, Union, Optional
+from .models import User, Message, Conversation, Element, SEARCH_CONFIG
+from .models import ConversationFeedbackStats, UserFeedbackStats
 from .database import async_session
-import datetime 
 from dateutil import parser
 from sqlalchemy.future import select
-from typing import TypeVar, Generic, List, Optional
-from sqlalchemy import update, delete
-from sqlalchemy.orm import joinedload
-from sqlalchemy.orm import selectinload
-from .utilities import parse_created_at, format_datetime, export_datetime
-from .utilities import log_function_call
+from typing import TypeVar, Generic, AsyncGenerator
+from sqlalchemy import update, delete, tuple_, func, literal, exists
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from .utilities import parse_created_at, parse_time_bound, format_datetime, export_datetime
+from .utilities import encode_cursor, decode_cursor
+from .loaders import get_loaders, load_messages, load_elements
+from .ingest import message_row, insert_messages
+from .write_behind import message_buffer
+from .instrumentation import ResolverMetrics, SQLAccounting
+from .persisted_queries import DocumentCache
+from .limits import LIST_SIZES, QueryLimits
+from . import conversation_cache
+from .purge import conversation_purger, purge_status
+from .storage import get_storage
+from .pubsub import pubsub, conversation_topic
+from .users import get_user_by_username, forget as forget_user
+from .projection import (
+    CONVERSATION_COLUMNS, MESSAGE_COLUMNS, ELEMENT_COLUMNS,
+    columns_for, column_value, requested_fields
+)
+from strawberry.types import Info
 from graphql.language import ast
 
+import asyncio
 import uuid
-import time
+from types import SimpleNamespace
 from enum import Enum
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 @strawberry.scalar(
     description="The `JSON` scalar type represents JSON values as specified by ECMA-404"
@@ -74,6 +94,68 @@ class ElementType:
     forIds: List[str]
     objectKey: Optional[str]  # New field for object key
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# messageThread bounds; the depth bound also stops parentId cycles
+DEFAULT_THREAD_SIZE = 200
+MAX_THREAD_SIZE = 1000
+MAX_THREAD_DEPTH = 1000
+# Sizes the cost estimate assumes for list fields; see app/limits.py
+LIST_SIZES.update({
+    "Query.conversations": (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE),
+    "Query.messageThread": (DEFAULT_THREAD_SIZE, MAX_THREAD_SIZE),
+    # Conversations are loaded whole; this is a typical length, not a bound
+    "ConversationType.messages": (50, None),
+})
+# SQLSTATE Postgres reports for a violated foreign key
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+def decode_conversation_cursor(cursor: str):
+    """
+    Returns the (createdAt, id) keyset position stored in a conversation cursor.
+    """
+    values = decode_cursor(cursor)
+    if len(values) != 2:
+        raise ValueError("Invalid cursor.")
+    return parser.isoparse(values[0]), int(values[1])
+
+
+def decode_search_cursor(cursor: str):
+    """
+    Returns the (rank, id) keyset position stored in a search result cursor.
+    """
+    values = decode_cursor(cursor)
+    if len(values) != 2:
+        raise ValueError("Invalid cursor.")
+    return float(values[0]), int(values[1])
+
+
+async def search_snippets(session, ts_query, conversation_ids, message_criteria=()):
+    """
+    Returns a highlighted excerpt of the best matching message for each conversation.
+    The best message is picked first so ts_headline only runs once per conversation.
+    """
+    best = (
+        select(Message.conversation_id, Message.content)
+        .where(
+            Message.conversation_id.in_(conversation_ids),
+            Message.content_tsv.op("@@")(ts_query),
+            *message_criteria
+        )
+        .distinct(Message.conversation_id)
+        .order_by(Message.conversation_id, func.ts_rank(Message.content_tsv, ts_query).desc())
+        .subquery()
+    )
+    result = await session.execute(
+        select(
+            best.c.conversation_id,
+            func.ts_headline(SEARCH_CONFIG, best.c.content, ts_query, "MaxFragments=1, MaxWords=25, MinWords=8")
+        )
+    )
+    return {conversation_id: snippet for conversation_id, snippet in result.all()}
+
+
 @strawberry.type
 class PageInfo:
     endCursor: Optional[str]
@@ -113,24 +195,166 @@ class UserInput:
 
 @strawberry.input
 class MessageInput:
+    # Mirrors the arguments of Mutation.create_message
+    id: strawberry.ID
+    author: str
     content: str
-    user_id: strawberry.ID
+    conversationId: strawberry.ID
+    createdAt: Optional[StringOrFloat] = None
+    language: Optional[str] = None
+    prompt: Optional[Json] = None
     isError: Optional[bool] = False
+    parentId: Optional[str] = None
+    indent: Optional[int] = 0
+    authorIsUser: Optional[bool] = False
+    disableHumanFeedback: Optional[bool] = False
+    waitForAnswer: Optional[bool] = False
+
+@strawberry.type
+class BulkMessageResult:
+    id: strawberry.ID
+    success: bool
+    error: Optional[str] = None
 @strawberry.type
 class ConversationMessageType:
     id: strawberry.ID
     content: str
     createdAt: str
     isError: bool
+# The converters accept ORM objects or projected rows; see app/projection.py.
+def user_type(user) -> UserType:
+    return UserType(
+        id=column_value(user, "id", str),
+        username=column_value(user, "username"),
+        createdAt=column_value(user, "createdAt", format_datetime),
+        role=column_value(user, "role", Role),
+        image=column_value(user, "image"),
+        provider=column_value(user, "provider"),
+        tags=column_value(user, "tags")
+    )
+
+
+def message_type(message) -> MessageType:
+    return MessageType(
+        id=column_value(message, "id", str),
+        isError=column_value(message, "isError"),
+        parentId=column_value(message, "parentId", str),
+        indent=column_value(message, "indent"),
+        author=column_value(message, "author"),
+        content=column_value(message, "content"),
+        waitForAnswer=column_value(message, "waitForAnswer"),
+        humanFeedback=column_value(message, "humanFeedback"),
+        humanFeedbackComment=column_value(message, "humanFeedbackComment"),
+        disableHumanFeedback=column_value(message, "disableHumanFeedback"),
+        language=column_value(message, "language"),
+        prompt=column_value(message, "prompt") or None,
+        authorIsUser=column_value(message, "authorIsUser"),
+        createdAt=column_value(message, "createdAt", export_datetime)
+    )
+
+
+def element_type(element) -> ElementType:
+    return ElementType(
+        id=column_value(element, "id"),
+        conversationId=column_value(element, "conversation_id"),
+        type=column_value(element, "type"),
+        name=column_value(element, "name"),
+        mime=column_value(element, "mime"),
+        url=column_value(element, "url"),
+        display=column_value(element, "display"),
+        language=column_value(element, "language"),
+        size=column_value(element, "size"),
+        forIds=column_value(element, "for_ids"),
+        objectKey=column_value(element, "object_key")
+    )
+
+
 @strawberry.type
 class ConversationType:
     id: strawberry.ID
     createdAt: float 
-    appUser: UserType
     tags: List[str]
     metadata: Optional[Json]  
-    messages: List[MessageType]
-    elements: Optional[List[ElementType]]  
+    # Highlighted excerpt of the best matching message, only set for searches
+    snippet: Optional[str] = None
+    appUserId: strawberry.Private[Optional[int]] = None
+    # Set on conversations served from the conversation cache
+    prefetchedMessages: strawberry.Private[Optional[List[MessageType]]] = None
+    prefetchedElements: strawberry.Private[Optional[List[ElementType]]] = None
+
+    # Relationships resolve through per-request DataLoaders, so they cost nothing
+    # unless selected and one batched query per level when they are. Each loader
+    # only fetches the columns the selection asks for.
+    @strawberry.field
+    async def appUser(self, info: Info) -> UserType:
+        user = await get_loaders(info).users().load(self.appUserId)
+        return user_type(user)
+
+    @strawberry.field
+    async def messages(self, info: Info) -> List[MessageType]:
+        if self.prefetchedMessages is not None:
+            return self.prefetchedMessages
+        columns = columns_for(
+            requested_fields(info), MESSAGE_COLUMNS,
+            required=(Message.conversation_id, Message.id, Message.createdAt)
+        )
+        messages = await get_loaders(info).messages(columns).load(int(self.id))
+        return [message_type(message) for message in messages]
+
+    @strawberry.field
+    async def elements(self, info: Info) -> Optional[List[ElementType]]:
+        if self.prefetchedElements is not None:
+            return self.prefetchedElements
+        columns = columns_for(requested_fields(info), ELEMENT_COLUMNS, required=(Element.conversation_id,))
+        elements = await get_loaders(info).elements(columns).load(int(self.id))
+        return [element_type(element) for element in elements]
+
+
+def conversation_type(conversation, snippet: Optional[str] = None) -> ConversationType:
+    return ConversationType(
+        id=column_value(conversation, "id", str),
+        createdAt=column_value(conversation, "createdAt", format_datetime),
+        appUserId=column_value(conversation, "appUserId"),
+        tags=column_value(conversation, "tags"),
+        metadata={},
+        snippet=snippet
+    )
+
+
+ALL_MESSAGE_COLUMNS = columns_for(
+    MESSAGE_COLUMNS, MESSAGE_COLUMNS, required=(Message.conversation_id, Message.id, Message.createdAt)
+)
+ALL_ELEMENT_COLUMNS = columns_for(ELEMENT_COLUMNS, ELEMENT_COLUMNS, required=(Element.conversation_id,))
+
+
+async def load_cacheable_conversation(conversation_id: int) -> Optional[ConversationType]:
+    """
+    Loads a conversation with all of its messages and elements, and caches the
+    result unless it includes messages still waiting in the write-behind buffer.
+    """
+    token = conversation_cache.begin_load()
+    # Checked before loading: a batch committing meanwhile invalidates the conversation anyway
+    has_pending = bool(message_buffer.pending_for(conversation_id))
+    async with async_session() as session:
+        result = await session.execute(
+            select(Conversation).where(Conversation.id == conversation_id, Conversation.deletedAt.is_(None))
+        )
+        conversation = result.scalars().first()
+    if not conversation:
+        return None
+    (messages,), (elements,) = await asyncio.gather(
+        load_messages(ALL_MESSAGE_COLUMNS, [conversation_id]),
+        load_elements(ALL_ELEMENT_COLUMNS, [conversation_id])
+    )
+    cached = conversation_type(conversation)
+    cached.prefetchedMessages = [message_type(message) for message in messages]
+    cached.prefetchedElements = [element_type(element) for element in elements]
+    if not has_pending and not message_buffer.pending_for(conversation_id):
+        size = conversation_cache.payload_size([
+            strawberry.asdict(item) for item in cached.prefetchedMessages + cached.prefetchedElements
+        ])
+        conversation_cache.store(conversation_id, cached, size, token)
+    return cached
 
 
 @strawberry.type
@@ -147,6 +371,103 @@ class HumanFeedbackResponse:
 class DeleteConversationResponse:
     id: strawberry.ID
 
+@strawberry.type
+class PurgeStatus:
+    pendingConversations: int
+    pendingMessages: int
+    pendingElements: int
+    oldestDeletedAt: Optional[float]
+    # Counted by the worker that answers, since it started
+    purgedConversations: int
+    purgedMessages: int
+    purgedElements: int
+
+@strawberry.type
+class FeedbackStats:
+    messageCount: int
+    # Messages with a humanFeedback score, and those scored above and below zero
+    feedbackCount: int
+    positiveCount: int
+    negativeCount: int
+    # Mean humanFeedback of the messages that have one
+    averageFeedback: Optional[float]
+
+def feedback_stats(row) -> FeedbackStats:
+    if row is None:
+        return FeedbackStats(messageCount=0, feedbackCount=0, positiveCount=0, negativeCount=0, averageFeedback=None)
+    return FeedbackStats(
+        messageCount=row.message_count,
+        feedbackCount=row.feedback_count,
+        positiveCount=row.positive_count,
+        negativeCount=row.negative_count,
+        averageFeedback=row.feedback_sum / row.feedback_count if row.feedback_count else None
+    )
+
+@strawberry.type
+class ThreadNode:
+    # 0 for the root message
+    depth: int
+    # Whether the message has replies, returned or not; expand it with its own messageThread
+    hasReplies: bool
+    message: MessageType
+
+@strawberry.type
+class MessageThread:
+    nodes: List[ThreadNode]
+    # The subtree within maxDepth holds more than `first` messages
+    truncated: bool
+
+@strawberry.type
+class MessageEvent:
+    # create_message, update_message or set_human_feedback
+    event: str
+    conversationId: strawberry.ID
+    messageId: strawberry.ID
+    # Carried by the event unless it was too large for the pub/sub backend
+    publishedMessage: strawberry.Private[Optional[MessageType]] = None
+
+    @strawberry.field
+    async def message(self) -> Optional[MessageType]:
+        if self.publishedMessage is not None:
+            return self.publishedMessage
+        async with async_session() as session:
+            result = await session.execute(
+                select(*ALL_MESSAGE_COLUMNS).where(Message.id == uuid.UUID(str(self.messageId)))
+            )
+            row = result.first()
+        return message_type(row) if row is not None else None
+
+
+async def publish_message_event(event: str, row):
+    """
+    Publishes a message change to the subscribers of its conversation.
+    """
+    message = message_type(row)
+    await pubsub.publish(conversation_topic(row.conversation_id), {
+        "event": event,
+        "conversationId": row.conversation_id,
+        "messageId": message.id,
+        "message": strawberry.asdict(message),
+    })
+
+
+async def publish_buffered_messages(rows: List[dict]):
+    for row in rows:
+        await publish_message_event("create_message", SimpleNamespace(**row))
+
+
+message_buffer.add_commit_listener(publish_buffered_messages)
+
+
+def message_event(payload: dict) -> MessageEvent:
+    message = payload.get("message")
+    return MessageEvent(
+        event=payload["event"],
+        conversationId=str(payload["conversationId"]),
+        messageId=payload["messageId"],
+        publishedMessage=MessageType(**message) if message is not None else None
+    )
+
 @strawberry.type
 class Edge(Generic[T]):
     node: T
@@ -165,186 +486,233 @@ class UpdateConversationInput:
 class Query:
     @strawberry.field
     async def get_app_user(self, username: str) -> Optional[UserType]:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.username == username))
-            user = result.scalars().first()
-            new_createdAt = format_datetime(user.createdAt)
-            print("type(new_createdAt)", type(new_createdAt), "new_createdAt", new_createdAt)
-            if user:
-                return UserType(
-                    id=str(user.id),
-                    username=user.username,
-                    createdAt=new_createdAt,
-                    role=user.role,
-                    image=user.image,
-                    provider=user.provider,
-                    tags = user.tags
-                )
-            return None
+        user = await get_user_by_username(username)
+        if user:
+            return user_type(user)
+        return None
 
     @strawberry.field
     async def conversations(
         self,
+        info: Info,
         first: Optional[int] = None,
         cursor: Optional[str] = None,
         withFeedback: Optional[int] = None,
         username: Optional[str] = None,
-        search: Optional[str] = None
+        search: Optional[str] = None,
+        since: Optional[StringOrFloat] = None,
+        until: Optional[StringOrFloat] = None
     ) -> PaginatedResponse[Edge[ConversationType]]:
+        if first is not None and first < 1:
+            raise ValueError("`first` must be at least 1.")
+        page_size = min(first or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        # Only conversations with messages created in [since, until); search and withFeedback
+        # only look at those messages, so a partitioned message table scans just those months
+        message_window = []
+        if since is not None:
+            message_window.append(Message.createdAt >= parse_time_bound(since, "since"))
+        if until is not None:
+            message_window.append(Message.createdAt < parse_time_bound(until, "until"))
+        # id and createdAt are always needed for the loaders and the cursor
+        columns = columns_for(
+            requested_fields(info, "edges", "node"), CONVERSATION_COLUMNS,
+            required=(Conversation.id, Conversation.createdAt)
+        )
+        # Soft-deleted conversations stay hidden until the purge removes them
+        query = select(*columns).where(Conversation.deletedAt.is_(None))
+        if username:
+            # Resolve the user through the cache instead of joining app_user
+            user = await get_user_by_username(username)
+            if user is None:
+                return PaginatedResponse(pageInfo=PageInfo(endCursor=None, hasNextPage=False), edges=[])
+            query = query.where(Conversation.appUserId == user.id)
         async with async_session() as session:
-            query = select(Conversation).options(
-                selectinload(Conversation.appUser),
-                selectinload(Conversation.messages),
-                selectinload(Conversation.elements)  # Load elements as well
-            ).order_by(Conversation.createdAt.desc())
-            if username:
-                query = query.join(User).where(User.username == username)
+            # Chainlit sends 0 for "all feedback", so only -1/1 filter anything
+            if withFeedback:
+                query = query.where(
+                    select(Message.id)
+                    .where(
+                        Message.conversation_id == Conversation.id,
+                        Message.humanFeedback.isnot(None),
+                        Message.humanFeedback == withFeedback,
+                        *message_window
+                    )
+                    .exists()
+                )
+            elif message_window and not search:
+                query = query.where(
+                    select(Message.id).where(Message.conversation_id == Conversation.id, *message_window).exists()
+                )
+            if search:
+                # Rank each conversation by its best matching message
+                ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, search)
+                matches = (
+                    select(
+                        Message.conversation_id,
+                        func.max(func.ts_rank(Message.content_tsv, ts_query)).label("rank")
+                    )
+                    .where(Message.content_tsv.op("@@")(ts_query), *message_window)
+                    .group_by(Message.conversation_id)
+                    .subquery()
+                )
+                query = (
+                    query.join(matches, matches.c.conversation_id == Conversation.id)
+                    .add_columns(matches.c.rank)
+                    .order_by(matches.c.rank.desc(), Conversation.id.desc())
+                )
+                if cursor:
+                    rank, conversation_id = decode_search_cursor(cursor)
+                    query = query.where(
+                        tuple_(matches.c.rank, Conversation.id) < tuple_(rank, conversation_id)
+                    )
+            else:
+                query = query.order_by(Conversation.createdAt.desc(), Conversation.id.desc())
+                if cursor:
+                    created_at, conversation_id = decode_conversation_cursor(cursor)
+                    query = query.where(
+                        tuple_(Conversation.createdAt, Conversation.id) < tuple_(created_at, conversation_id)
+                    )
+            # Fetch one extra row to know whether another page follows
+            query = query.limit(page_size + 1)
             try:
                 result = await session.execute(query)
-                conversations = result.scalars().all()
-            except Exception as e:
-                print("Error executing query:", e)
+                rows = result.all()
+            except Exception:
+                logger.exception("Listing conversations failed")
                 return PaginatedResponse(pageInfo=PageInfo(endCursor=None, hasNextPage=False), edges=[])
 
-            if not conversations:
+            has_next_page = len(rows) > page_size
+            rows = rows[:page_size]
+            if not rows:
                 return PaginatedResponse(pageInfo=PageInfo(endCursor=None, hasNextPage=False), edges=[])
+            snippets = {}
+            if search:
+                snippets = await search_snippets(session, ts_query, [row.id for row in rows], message_window)
             edges = [
                 Edge(
-                    node=ConversationType(
-                        id=str(conversation.id),
-                        createdAt=format_datetime(conversation.createdAt),
-                        appUser=UserType(
-                            id=str(conversation.appUser.id),
-                            username=conversation.appUser.username,
-                            createdAt=format_datetime(conversation.appUser.createdAt),
-                            role=Role(conversation.appUser.role),
-                            image=conversation.appUser.image,
-                            provider=conversation.appUser.provider,
-                            tags=conversation.appUser.tags
-                        ),
-                        tags=conversation.tags,
-                        messages=[
-                            MessageType(
-                                id=str(message.id),
-                                isError=message.isError,
-                                parentId=str(message.parentId) if message.parentId else None,
-                                indent=message.indent,
-                                author=message.author,
-                                content=message.content,
-                                waitForAnswer=message.waitForAnswer,
-                                humanFeedback=message.humanFeedback,  # Correctly handle this field
-                                humanFeedbackComment=message.humanFeedbackComment,  # Correctly handle this field
-                                disableHumanFeedback=message.disableHumanFeedback,
-                                language=message.language,
-                                prompt=message.prompt if message.prompt else None,
-                                authorIsUser=message.authorIsUser,
-                                createdAt=export_datetime(message.createdAt)
-                            ) for message in conversation.messages
-                        ],
-                        elements = [
-                            ElementType(
-                                id=element.id,
-                                conversationId=element.conversation_id,
-                                type=element.type,
-                                name=element.name,
-                                mime=element.mime,
-                                url=element.url,
-                                display=element.display,
-                                language=element.language,
-                                size=element.size,
-                                forIds=element.for_ids,
-                                objectKey=element.object_key
-                            ) for element in conversation.elements
-                        ],
-                        metadata={}
-
-                    ),
-                    cursor=str(conversation.id)
-                ) for conversation in conversations
+                    node=conversation_type(row, snippet=snippets.get(row.id)),
+                    cursor=encode_cursor(row.rank if search else row.createdAt, row.id)
+                ) for row in rows
             ]
             page_info = PageInfo(
-                endCursor=str(conversations[-1].id) if conversations else None, 
-                hasNextPage=False
+                endCursor=edges[-1].cursor,
+                hasNextPage=has_next_page
             )
             return PaginatedResponse(pageInfo=page_info, edges=edges)
 
     @strawberry.field
-    async def conversation(self, id: strawberry.ID) -> Optional[ConversationType]:
+    async def conversation(self, info: Info, id: strawberry.ID) -> Optional[ConversationType]:
+        fields = requested_fields(info)
+        if conversation_cache.enabled():
+            cached = conversation_cache.get(id)
+            if cached is not None:
+                return cached
+            # A miss loads every message and element, which only pays off if they were asked for
+            if "messages" in fields or "elements" in fields:
+                return await load_cacheable_conversation(int(id))
+        columns = columns_for(fields, CONVERSATION_COLUMNS, required=(Conversation.id,))
         async with async_session() as session:
             result = await session.execute(
-                select(Conversation)
-                .options(selectinload(Conversation.appUser))
-                .where(Conversation.id == int(id))
+                select(*columns).where(Conversation.id == int(id), Conversation.deletedAt.is_(None))
             )
-            conversation = result.scalars().first()
+            conversation = result.first()
             if not conversation:
                 return None
-            messages_result = await session.execute(
-                select(Message)
-                .where(Message.conversation_id == conversation.id)
-                .order_by(Message.createdAt.asc())
-            )
-            messages = messages_result.scalars().all()
-            messages = [
-                MessageType(
-                    id=str(message.id),
-                    isError=message.isError,
-                    parentId=str(message.parentId) if message.parentId else None,
-                    indent=message.indent,
-                    author=message.author,
-                    content=message.content,
-                    waitForAnswer=message.waitForAnswer,
-                    humanFeedback=message.humanFeedback,
-                    humanFeedbackComment=message.humanFeedbackComment,
-                    disableHumanFeedback=message.disableHumanFeedback,
-                    language=message.language,
-                    prompt=message.prompt if message.prompt else None,
-                    authorIsUser=message.authorIsUser,
-                    createdAt=export_datetime(message.createdAt)
-                ) for message in messages 
-            ]
-            elements_result = await session.execute(
-                select(Element)
-                .where(Element.conversation_id == conversation.id)
+            return conversation_type(conversation)
+
+    @strawberry.field
+    async def message_thread(
+        self,
+        info: Info,
+        rootId: strawberry.ID,
+        maxDepth: Optional[int] = None,
+        first: Optional[int] = None
+    ) -> Optional[MessageThread]:
+        """
+        Returns a message and its replies down to `maxDepth` levels, level by
+        level, in one recursive query. At most `first` messages are returned;
+        the deepest level may be cut short.
+        """
+        max_depth = min(MAX_THREAD_DEPTH if maxDepth is None else maxDepth, MAX_THREAD_DEPTH)
+        if first is not None and first < 1:
+            raise ValueError("`first` must be at least 1.")
+        size = min(first or DEFAULT_THREAD_SIZE, MAX_THREAD_SIZE)
+        columns = columns_for(
+            requested_fields(info, "nodes", "message"), MESSAGE_COLUMNS,
+            required=(Message.id, Message.createdAt)
+        )
+        thread = (
+            select(Message.id, Message.conversation_id, literal(0).label("depth"))
+            .join(Conversation, Message.conversation_id == Conversation.id)
+            .where(Message.id == uuid.UUID(str(rootId)), Conversation.deletedAt.is_(None))
+            .cte("thread", recursive=True)
+        )
+        reply = aliased(Message)
+        # Follows ix_message_parentId one level per iteration
+        thread = thread.union_all(
+            select(reply.id, reply.conversation_id, thread.c.depth + 1)
+            .where(
+                reply.parentId == thread.c.id,
+                reply.conversation_id == thread.c.conversation_id,
+                thread.c.depth < max_depth
             )
-            elements = elements_result.scalars().all()
-
-            # Convert elements to ElementType
-            element_type = [
-                ElementType(
-                    id=element.id,
-                    conversationId=element.conversation_id,
-                    type=element.type,
-                    name=element.name,
-                    mime=element.mime,
-                    objectKey=element.object_key,
-                    url=element.url,
-                    display=element.display,
-                    language=element.language,
-                    size=element.size,
-                    forIds=element.for_ids
-                ) for element in elements
-            ]
+        )
+        # Postgres stops expanding the CTE once the LIMIT is met, so huge traces cost `first` rows
+        nodes = select(thread.c.id, thread.c.depth).limit(size + 1).subquery()
+        child = aliased(Message)
+        query = (
+            select(*columns, nodes.c.depth, exists().where(child.parentId == Message.id).label("has_replies"))
+            .join(nodes, nodes.c.id == Message.id)
+            .order_by(nodes.c.depth, Message.createdAt, Message.id)
+        )
+        async with async_session() as session:
+            rows = (await session.execute(query)).all()
+        if not rows:
+            return None
+        return MessageThread(
+            nodes=[
+                ThreadNode(depth=row.depth, hasReplies=row.has_replies, message=message_type(row))
+                for row in rows[:size]
+            ],
+            truncated=len(rows) > size
+        )
 
-            return ConversationType(
-                id=str(conversation.id),
-                #use the format_datetime function to parse the createdAt
-                createdAt=format_datetime(conversation.createdAt),
-                appUser=UserType(
-                    id=str(conversation.appUser.id),
-                    username=conversation.appUser.username,
-                    createdAt=format_datetime(conversation.createdAt),
-                    role=Role(conversation.appUser.role),
-                    image=conversation.appUser.image,
-                    provider=conversation.appUser.provider,
-                    tags=conversation.appUser.tags
-                ),
-                tags=conversation.tags,
-                messages=messages,
-                elements=element_type,  
-                metadata={}  
+    @strawberry.field
+    async def conversation_feedback_stats(self, conversationId: strawberry.ID) -> FeedbackStats:
+        """
+        Totals over the conversation's messages, read from the maintained stats table.
+        """
+        async with async_session() as session:
+            result = await session.execute(
+                select(ConversationFeedbackStats)
+                .where(ConversationFeedbackStats.conversation_id == int(conversationId))
+            )
+            return feedback_stats(result.scalars().first())
 
+    @strawberry.field
+    async def user_feedback_stats(self, appUserId: strawberry.ID) -> FeedbackStats:
+        """
+        Totals over the messages of the user's conversations that are not deleted.
+        """
+        async with async_session() as session:
+            result = await session.execute(
+                select(UserFeedbackStats).where(UserFeedbackStats.app_user_id == int(appUserId))
             )
+            return feedback_stats(result.scalars().first())
+
+    @strawberry.field
+    async def purge_status(self) -> PurgeStatus:
+        status = await purge_status()
+        oldest = status["oldest_deleted_at"]
+        return PurgeStatus(
+            pendingConversations=status["pending_conversations"],
+            pendingMessages=status["pending_messages"],
+            pendingElements=status["pending_elements"],
+            oldestDeletedAt=format_datetime(oldest) if oldest else None,
+            purgedConversations=status["purged_conversations"],
+            purgedMessages=status["purged_messages"],
+            purgedElements=status["purged_elements"]
+        )
 
 
 @strawberry.type
@@ -352,63 +720,64 @@ class Mutation:
 
     @strawberry.mutation
     async def update_conversation(self, conversation_data: UpdateConversationInput) -> Optional[ConversationType]:
+        conversation_id = int(conversation_data.id)
         async with async_session() as session:
-            stmt = update(Conversation).where(Conversation.id == int(conversation_data.id))
-            if conversation_data.tags is not None:
-                stmt = stmt.values(tags=conversation_data.tags)
-            result = await session.execute(stmt)
-            await session.commit()
-            updated_conversation = result.fetchone()
-            if updated_conversation:
-                return ConversationType(
-                    id=str(updated_conversation.id),
-                    createdAt=updated_conversation.createdAt,
-                    appUser=UserType(
-                        id=str(updated_conversation.appUser.id),
-                        username=updated_conversation.appUser.username,
-                        createdAt=updated_conversation.appUser.createdAt,
-                        role=Role(updated_conversation.appUser.role),
-                        image=updated_conversation.appUser.image,
-                        provider=updated_conversation.appUser.provider,
-                        tags=updated_conversation.appUser.tags
-                    ),
-                    tags=updated_conversation.tags
+            if conversation_data.tags is None:
+                # Nothing to update, so just return the conversation
+                result = await session.execute(
+                    select(Conversation).where(Conversation.id == conversation_id, Conversation.deletedAt.is_(None))
                 )
+                updated_conversation = result.scalars().first()
+            else:
+                stmt = (
+                    update(Conversation)
+                    .where(Conversation.id == conversation_id, Conversation.deletedAt.is_(None))
+                    .values(tags=conversation_data.tags)
+                    .returning(Conversation)
+                )
+                result = await session.execute(stmt)
+                updated_conversation = result.scalars().first()
+                await session.commit()
+                conversation_cache.invalidate(conversation_id)
+            if updated_conversation:
+                return conversation_type(updated_conversation)
             return None
     @strawberry.mutation
     async def create_app_user(self, username: str, role: Role, provider: Optional[str], image: Optional[str], tags: Optional[List[str]] = None) -> UserType:
         async with async_session() as session:
-            existing_user = await session.execute(select(User).where(User.username == username))
-            if existing_user.scalars().first():
-                raise Exception(f"Username '{username}' is already taken.")
-            new_user = User(
-                username=username,
-                role=role.value,
-                tags=tags if tags is not None else [],
-                provider=provider,
-                image=image
+            # The unique username index decides races between concurrent signups
+            stmt = (
+                insert(User)
+                .values(
+                    username=username,
+                    role=role.value,
+                    tags=tags if tags is not None else [],
+                    provider=provider,
+                    image=image
+                )
+                .on_conflict_do_nothing(index_elements=[User.username])
+                .returning(User)
             )
-            session.add(new_user)
+            result = await session.execute(stmt)
+            new_user = result.scalars().first()
+            if new_user is None:
+                raise Exception(f"Username '{username}' is already taken.")
             await session.commit()
-            return UserType(
-                id=str(new_user.id),
-                username=new_user.username,
-                createdAt=new_user.createdAt,
-                role=Role(new_user.role),
-                tags=new_user.tags,
-                provider=new_user.provider,
-                image=new_user.image
-            )
+            forget_user(username=username)
+            return user_type(new_user)
 
     @strawberry.mutation
     async def update_user(self, id: strawberry.ID, user_data: UserInput) -> Optional[UserType]:
         async with async_session() as session:
-            stmt = update(User).where(User.id == int(id)).values(username=user_data.username, role=user_data.role, image=user_data.image, provider=user_data.provider).returning(User)
+            # A null role keeps the current one; the column is NOT NULL
+            role = user_data.role.value if user_data.role else User.role
+            stmt = update(User).where(User.id == int(id)).values(username=user_data.username, role=role, image=user_data.image, provider=user_data.provider).returning(User)
             result = await session.execute(stmt)
+            updated_user = result.scalars().first()
             await session.commit()
-            updated_user = result.fetchone()
+            forget_user(user_id=int(id), username=user_data.username)
             if updated_user:
-                return UserType(id=str(updated_user.id), username=updated_user.username, createdAt=str(updated_user.createdAt), role=updated_user.role, image=updated_user.image, provider=updated_user.provider)
+                return user_type(updated_user)
             return None
 
     @strawberry.mutation
@@ -417,6 +786,7 @@ class Mutation:
             stmt = delete(User).where(User.id == int(id))
             await session.execute(stmt)
             await session.commit()
+            forget_user(user_id=int(id))
             return True
     
     @strawberry.mutation
@@ -426,19 +796,24 @@ class Mutation:
         human_feedback: int, 
         human_feedback_comment: Optional[str] = None
     ) -> HumanFeedbackResponse:
+        uuid_message_id = uuid.UUID(str(message_id))
+        await message_buffer.flush_message(uuid_message_id)
         async with async_session() as session:
-            uuid_message_id = uuid.UUID(str(message_id))
             stmt = (
                 update(Message)
                 .where(Message.id == uuid_message_id)
                 .values(humanFeedback=human_feedback)
+                .returning(*ALL_MESSAGE_COLUMNS)
             )
             if human_feedback_comment is not None:
                 stmt = stmt.values(humanFeedbackComment=human_feedback_comment)
-            await session.execute(stmt)
+            result = await session.execute(stmt)
+            updated_message = result.first()
+            if updated_message is None:
+                raise ValueError(f"Message '{message_id}' does not exist.")
             await session.commit()
-            result = await session.execute(select(Message).where(Message.id == uuid_message_id))
-            updated_message = result.scalar_one()
+            conversation_cache.invalidate(updated_message.conversation_id)
+            await publish_message_event("set_human_feedback", updated_message)
             return HumanFeedbackResponse(
                 id=str(updated_message.id),
                 humanFeedback=updated_message.humanFeedback,
@@ -462,14 +837,24 @@ class Mutation:
         disableHumanFeedback: Optional[bool] = False,
         waitForAnswer: Optional[bool] = False,
     ) -> SimpleMessageResponse:
+        if message_buffer.enabled:
+            row = message_row(
+                id=id, author=author, content=content, conversationId=conversationId,
+                createdAt=createdAt, language=language, prompt=prompt, isError=isError,
+                parentId=parentId, indent=indent, authorIsUser=authorIsUser,
+                disableHumanFeedback=disableHumanFeedback, waitForAnswer=waitForAnswer
+            )
+            await message_buffer.enqueue(row)
+            conversation_cache.invalidate(row["conversation_id"])
+            # The event goes out from publish_buffered_messages once the row is committed
+            return SimpleMessageResponse(id=str(row["id"]))
         uuid_id = uuid.UUID(id)
         conversation_id_int = int(conversationId)
         created_at_datetime = parse_created_at(createdAt)
         async with async_session() as session:
-            new_message = Message(
+            new_message = dict(
                 id = uuid_id, 
                 content=content,
-                createdAt=created_at_datetime,
                 isError=isError,
                 conversation_id=conversation_id_int,  
                 author=author,
@@ -481,9 +866,38 @@ class Mutation:
                 disableHumanFeedback=disableHumanFeedback,
                 waitForAnswer=waitForAnswer
             )
-            session.add(new_message)
+            if created_at_datetime is not None:
+                new_message["createdAt"] = created_at_datetime
+            # RETURNING hands the stored row, database defaults included, to subscribers
+            result = await session.execute(insert(Message).values(**new_message).returning(*ALL_MESSAGE_COLUMNS))
+            created_message = result.first()
             await session.commit()
-            return SimpleMessageResponse(id=str(new_message.id))  # Only return the ID of the new message
+            conversation_cache.invalidate(conversation_id_int)
+            await publish_message_event("create_message", created_message)
+            return SimpleMessageResponse(id=str(created_message.id))  # Only return the ID of the new message
+
+    @strawberry.mutation
+    async def create_messages(self, messages: List[MessageInput]) -> List[BulkMessageResult]:
+        """
+        Writes a batch of messages in one transaction, reporting success per item.
+        """
+        results = [None] * len(messages)
+        rows, positions = [], []
+        for position, message in enumerate(messages):
+            try:
+                rows.append(message_row(**strawberry.asdict(message)))
+                positions.append(position)
+            except ValueError as e:
+                results[position] = BulkMessageResult(id=message.id, success=False, error=str(e))
+        errors = await insert_messages(rows)
+        for conversation_id in {row["conversation_id"] for row in rows}:
+            conversation_cache.invalidate(conversation_id)
+        for position, error in zip(positions, errors):
+            results[position] = BulkMessageResult(id=messages[position].id, success=error is None, error=error)
+        for row, error in zip(rows, errors):
+            if error is None:
+                await publish_message_event("create_message", SimpleNamespace(**row))
+        return results
 
     @strawberry.mutation
     async def update_message(
@@ -495,8 +909,9 @@ class Mutation:
         prompt: Optional[Json] = None,
         disableHumanFeedback: Optional[bool] = None
     ) -> SimpleMessageResponse:
+        uuid_message_id = uuid.UUID(str(messageId))
+        await message_buffer.flush_message(uuid_message_id)
         async with async_session() as session:
-            uuid_message_id = uuid.UUID(str(messageId))
             uuid_parent_id = uuid.UUID(str(parentId)) if parentId else None
             stmt = update(Message).where(Message.id == uuid_message_id).values(
                 author=author,
@@ -505,21 +920,29 @@ class Mutation:
                 language=language,
                 prompt=prompt,
                 disableHumanFeedback=disableHumanFeedback
-            )
+            ).returning(*ALL_MESSAGE_COLUMNS)
 
             result = await session.execute(stmt)
+            updated_message = result.first()
             await session.commit()
-            if result.rowcount > 0:
+            if updated_message is not None:
+                conversation_cache.invalidate(updated_message.conversation_id)
+                await publish_message_event("update_message", updated_message)
                 return SimpleMessageResponse(id=str(uuid_message_id))
             else:
                 return None
 
     @strawberry.mutation
     async def delete_message(self, id: strawberry.ID) -> bool:
+        uuid_message_id = uuid.UUID(str(id))
+        await message_buffer.flush_message(uuid_message_id)
         async with async_session() as session:
-            stmt = delete(Message).where(Message.id == int(id))
-            await session.execute(stmt)
+            stmt = delete(Message).where(Message.id == uuid_message_id).returning(Message.conversation_id)
+            result = await session.execute(stmt)
+            conversation_id = result.scalar()
             await session.commit()
+            if conversation_id is not None:
+                conversation_cache.invalidate(conversation_id)
             return True
     
     @strawberry.mutation
@@ -534,11 +957,18 @@ class Mutation:
         objectKey: Optional[str] = None,
         size: Optional[str] = None,
         language: Optional[str] = None,
-        mime: Optional[str] = None
+        mime: Optional[str] = None,
+        upload: Optional[str] = None
     ) -> Optional[ElementType]:
+        if upload is not None:
+            # objectKey returned by POST /api/uploads
+            stored = await get_storage().stat(upload)
+            if stored is None:
+                raise ValueError("Unknown upload")
+            objectKey = stored.key
+            size = size if size is not None else str(stored.size)
+            mime = mime if mime is not None else stored.mime
         async with async_session() as session:
-            # Convert the size from string to integer if necessary
-
             new_element = Element(
                 conversation_id=int(conversationId),  # Assuming conversationId is a string of integer
                 type=type,
@@ -553,6 +983,7 @@ class Mutation:
             )
             session.add(new_element)
             await session.commit()
+            conversation_cache.invalidate(new_element.conversation_id)
 
             return ElementType(
                 id=new_element.id,
@@ -575,44 +1006,57 @@ class Mutation:
         app_user_id_int = int(appUserId)
 
         async with async_session() as session:
-            result = await session.execute(select(User).where(User.id == app_user_id_int))
-            user = result.scalars().first()
-
-            if not user:
-                raise ValueError("Invalid appUserId")
-            new_conversation = Conversation(
-                appUserId=app_user_id_int,
-                tags=tags if tags is not None else []
+            stmt = (
+                insert(Conversation)
+                .values(appUserId=app_user_id_int, tags=tags if tags is not None else [])
+                .returning(Conversation)
             )
-            session.add(new_conversation)
+            try:
+                result = await session.execute(stmt)
+            except IntegrityError as e:
+                # The appUserId foreign key replaces a lookup of the user
+                if getattr(e.orig, "sqlstate", None) == FOREIGN_KEY_VIOLATION:
+                    raise ValueError("Invalid appUserId")
+                raise
+            new_conversation = result.scalars().first()
             await session.commit()
 
-            return ConversationType(
-                id=str(new_conversation.id),
-                createdAt=new_conversation.createdAt,
-                appUser=UserType(
-                    id=str(user.id),
-                    username=user.username,
-                    createdAt=user.createdAt,
-                    role=Role(user.role),
-                    image=user.image,
-                    provider=user.provider,
-                    tags=user.tags
-                ),
-                tags=new_conversation.tags,
-                messages=[],  
-                elements=[],  
-                metadata={}  
-            )
+            return conversation_type(new_conversation)
 
     @strawberry.mutation
     async def delete_conversation(self, id: strawberry.ID) -> Optional[DeleteConversationResponse]:
+        conversation_id = int(id)
         async with async_session() as session:
-            await session.execute(delete(Message).where(Message.conversation_id == int(id)))
-            stmt = delete(Conversation).where(Conversation.id == int(id))
+            # Only mark the conversation; conversation_purger deletes its rows in batches
+            stmt = (
+                update(Conversation)
+                .where(Conversation.id == conversation_id, Conversation.deletedAt.is_(None))
+                .values(deletedAt=func.now())
+            )
             await session.execute(stmt)
             await session.commit()
+            conversation_cache.invalidate(id)
+            conversation_purger.wake()
             return DeleteConversationResponse(id=id)
 
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+@strawberry.type
+class Subscription:
+    @strawberry.subscription
+    async def message_events(self, conversationId: strawberry.ID) -> AsyncGenerator[MessageEvent, None]:
+        """
+        Streams message changes of one conversation. A subscriber that falls
+        behind gets an error and has to subscribe again and refetch.
+        """
+        subscriber = pubsub.subscribe(conversation_topic(conversationId))
+        try:
+            while True:
+                yield message_event(await subscriber.get())
+        finally:
+            pubsub.unsubscribe(subscriber)
+
+
+schema = strawberry.Schema(
+    query=Query, mutation=Mutation, subscription=Subscription,
+    extensions=[DocumentCache, QueryLimits, SQLAccounting, ResolverMetrics]
+)
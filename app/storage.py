@@ -0,0 +1,281 @@
+# app/storage.py
+"""
+Content-addressed storage for element payloads.
+
+    POST /api/uploads            (streamed body; Content-Type is kept as the mime)
+    GET  /api/blobs/{objectKey}  (supports Range, If-None-Match and HEAD)
+
+An upload is stored under the sha256 of its bytes, which becomes the
+element's object key, so uploading the same content twice stores it once,
+with the mime of the first upload. createElement(upload: <objectKey>) fills
+in the element's object key, size and mime from the stored upload.
+
+ELEMENT_STORAGE selects the backend from STORAGE_BACKENDS; `local` keeps
+blobs under ELEMENT_STORAGE_PATH. Local blobs are served with the ASGI
+zero-copy extension (sendfile) when the server offers it, and read in
+chunks otherwise.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from starlette.responses import Response
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ELEMENT_STORAGE = os.environ.get("ELEMENT_STORAGE", "local")
+ELEMENT_STORAGE_PATH = os.environ.get("ELEMENT_STORAGE_PATH", "element-storage")
+ELEMENT_UPLOAD_MAX_BYTES = int(os.environ.get("ELEMENT_UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Bytes read per chunk when a blob cannot be sent with sendfile
+READ_CHUNK_SIZE = 256 * 1024
+OBJECT_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+STORAGE_UPLOADS = Counter("element_storage_uploads_total", "Uploads received, by outcome", ["outcome"])
+STORAGE_BYTES = Counter("element_storage_bytes_total", "Bytes uploaded or served", ["direction"])
+
+router = APIRouter()
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    mime: Optional[str] = None
+
+
+class ElementStorage(ABC):
+    """
+    Interface of the element storage backends. Keys are the sha256 hex
+    digest of the content, and content keeps the mime of its first upload.
+    """
+
+    @abstractmethod
+    async def put(self, chunks: AsyncIterator[bytes], mime: Optional[str] = None,
+                  max_size: Optional[int] = None) -> StoredObject:
+        """
+        Stores the content of `chunks` and returns it as stored, mime included.
+        """
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        pass
+
+    @abstractmethod
+    async def read(self, key: str, offset: int, length: int) -> AsyncIterator[bytes]:
+        pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        """
+        Path of the blob on this machine, for backends that can serve it with sendfile.
+        """
+        return None
+
+
+class LocalFileStorage(ElementStorage):
+    """
+    Blobs as files under `root`, fanned out as ab/cd/<sha256>, each with a
+    small JSON sidecar holding its size and mime. Uploads are written to a
+    temporary file while being hashed and renamed into place, so readers
+    never see a partial blob.
+    """
+
+    def __init__(self, root: str = ELEMENT_STORAGE_PATH):
+        self.root = root
+        self.incoming = os.path.join(root, "incoming")
+        os.makedirs(self.incoming, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+    async def put(self, chunks, mime=None, max_size=None) -> StoredObject:
+        digest = hashlib.sha256()
+        size = 0
+        fd, temporary = tempfile.mkstemp(dir=self.incoming)
+        try:
+            with os.fdopen(fd, "wb") as blob_file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise UploadTooLarge(f"Upload exceeds {max_size} bytes.")
+                    digest.update(chunk)
+                    await asyncio.to_thread(blob_file.write, chunk)
+            key = digest.hexdigest()
+            stored = await asyncio.to_thread(self._commit, temporary, StoredObject(key=key, size=size, mime=mime))
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        STORAGE_BYTES.inc(size, direction="in")
+        return stored
+
+    def _commit(self, temporary: str, stored: StoredObject) -> StoredObject:
+        path = self._path(stored.key)
+        if os.path.exists(path):
+            STORAGE_UPLOADS.inc(outcome="deduplicated")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+            STORAGE_UPLOADS.inc(outcome="stored")
+        # Created only once, so later uploads of the same content cannot change its mime
+        try:
+            with open(path + ".json", "x") as meta_file:
+                json.dump({"size": stored.size, "mime": stored.mime}, meta_file)
+        except FileExistsError:
+            return self._stat(stored.key)
+        return stored
+
+    def _stat(self, key: str) -> Optional[StoredObject]:
+        path = self._path(key)
+        try:
+            with open(path + ".json") as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                return None
+            meta = {"size": os.path.getsize(path), "mime": None}
+        return StoredObject(key=key, size=meta["size"], mime=meta.get("mime"))
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        if not OBJECT_KEY.match(key):
+            return None
+        return await asyncio.to_thread(self._stat, key)
+
+    async def read(self, key: str, offset: int, length: int) -> AsyncIterator[bytes]:
+        with open(self._path(key), "rb") as blob_file:
+            blob_file.seek(offset)
+            while length > 0:
+                chunk = await asyncio.to_thread(blob_file.read, min(READ_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+
+STORAGE_BACKENDS = {"local": LocalFileStorage}
+
+_storage: Optional[ElementStorage] = None
+
+
+def get_storage() -> ElementStorage:
+    global _storage
+    if _storage is None:
+        if ELEMENT_STORAGE not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown ELEMENT_STORAGE '{ELEMENT_STORAGE}'.")
+        _storage = STORAGE_BACKENDS[ELEMENT_STORAGE]()
+    return _storage
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (start, end) byte positions, end inclusive, of a single range
+    `Range` header, or None to send the whole blob. Multiple ranges are not
+    supported and also get the whole blob. Raises ValueError if the range
+    lies outside the blob.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range.")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range.")
+    return start, end
+
+
+class BlobResponse(Response):
+    """
+    Sends `length` bytes of a stored blob from `offset`, with sendfile when
+    the blob is a local file and the server supports the ASGI zero-copy
+    extension.
+    """
+
+    def __init__(self, storage: ElementStorage, stored: StoredObject, offset: int, length: int,
+                 status_code: int = 200, headers: Optional[dict] = None, method: str = "GET"):
+        self.storage = storage
+        self.stored = stored
+        self.offset = offset
+        self.length = length
+        self.status_code = status_code
+        self.media_type = stored.mime or "application/octet-stream"
+        self.background = None
+        self.send_header_only = method.upper() == "HEAD"
+        self.init_headers({**(headers or {}), "content-length": str(length)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        path = self.storage.local_path(self.stored.key)
+        if path is not None and "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(path, "rb") as blob_file:
+                await send({
+                    "type": "http.response.zerocopy", "file": blob_file,
+                    "offset": self.offset, "count": self.length, "more_body": False,
+                })
+        else:
+            async for chunk in self.storage.read(self.stored.key, self.offset, self.length):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        STORAGE_BYTES.inc(self.length, direction="out")
+
+
+@router.post("/api/uploads")
+async def upload(request: Request):
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > ELEMENT_UPLOAD_MAX_BYTES:
+        raise HTTPException(413, f"Upload exceeds {ELEMENT_UPLOAD_MAX_BYTES} bytes.")
+    mime = request.headers.get("content-type")
+    try:
+        stored = await get_storage().put(request.stream(), mime=mime, max_size=ELEMENT_UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(413, str(e))
+    return {"objectKey": stored.key, "size": stored.size, "mime": stored.mime}
+
+
+@router.api_route("/api/blobs/{key}", methods=["GET", "HEAD"])
+async def download(key: str, request: Request):
+    storage = get_storage()
+    stored = await storage.stat(key)
+    if stored is None:
+        raise HTTPException(404, "Blob not found.")
+    etag = f'"{stored.key}"'
+    # Content never changes under its key
+    headers = {"accept-ranges": "bytes", "etag": etag, "cache-control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), stored.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{stored.size}"})
+    if byte_range is None:
+        return BlobResponse(storage, stored, 0, stored.size, headers=headers, method=request.method)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{stored.size}"
+    return BlobResponse(storage, stored, start, end - start + 1, status_code=206, headers=headers, method=request.method)
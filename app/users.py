@@ -0,0 +1,92 @@
+# app/users.py
+import os
+from types import SimpleNamespace
+from typing import List, Optional
+from sqlalchemy.future import select
+from .cache import LRUCache
+from .database import async_session
+from .models import User
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+
+# Keys are ("id", <int>) and ("username", <str>); both point at the same snapshot
+user_cache = LRUCache("user", max_weight=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def snapshot(user) -> SimpleNamespace:
+    """
+    Copies a user row into a plain object that is safe to share between requests.
+    """
+    return SimpleNamespace(
+        id=user.id,
+        username=user.username,
+        createdAt=user.createdAt,
+        role=user.role,
+        image=user.image,
+        provider=user.provider,
+        tags=list(user.tags or []),
+    )
+
+
+def begin_load() -> int:
+    """
+    Returns a token to pass to `remember` so a load that raced with an update
+    does not cache what it read before the update committed.
+    """
+    return user_cache.begin_load()
+
+
+def remember(user, token: int) -> SimpleNamespace:
+    cached = snapshot(user)
+    user_cache.set_many({("id", cached.id): cached, ("username", cached.username): cached}, token=token)
+    return cached
+
+
+def forget(user_id: Optional[int] = None, username: Optional[str] = None):
+    """
+    Drops a user from the cache. Looking up the other key first makes sure a
+    rename also drops the old username entry.
+    """
+    if user_id is not None:
+        cached = user_cache.peek(("id", user_id))
+        if cached is not None:
+            user_cache.invalidate(("username", cached.username))
+        user_cache.invalidate(("id", user_id))
+    if username is not None:
+        cached = user_cache.peek(("username", username))
+        if cached is not None:
+            user_cache.invalidate(("id", cached.id))
+        user_cache.invalidate(("username", username))
+
+
+async def get_user_by_username(username: str) -> Optional[SimpleNamespace]:
+    cached = user_cache.get(("username", username))
+    if cached is not None:
+        return cached
+    token = begin_load()
+    async with async_session() as session:
+        result = await session.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
+    return remember(user, token) if user else None
+
+
+async def get_users_by_ids(user_ids: List[int]) -> List[Optional[SimpleNamespace]]:
+    """
+    Returns users in the order of `user_ids`, querying only the ids not cached.
+    """
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        cached = user_cache.get(("id", user_id))
+        if cached is not None:
+            users[user_id] = cached
+        else:
+            missing.append(user_id)
+    if missing:
+        token = begin_load()
+        async with async_session() as session:
+            result = await session.execute(select(User).where(User.id.in_(missing)))
+            for user in result.scalars():
+                users[user.id] = remember(user, token)
+    return [users.get(user_id) for user_id in user_ids]
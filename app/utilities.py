@@ -1,5 +1,10 @@
-from datetime import datetime
-import time
+from datetime import datetime, timezone
+import base64
+import binascii
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 # create a new function that takes in a datetime.datetime object and returns an integer date
 
@@ -26,7 +31,8 @@ def parse_created_at(createdAt):
     Parses the 'createdAt' parameter into a datetime object.
     Accepts either a float (representing a Unix timestamp) or a string (ISO 8601 format).
     """
-    print(f"Type of createdAt: {type(createdAt)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Parsing createdAt", extra={"created_at_type": type(createdAt).__name__})
     if createdAt is None:
         return None
 
@@ -43,8 +49,42 @@ def parse_created_at(createdAt):
         raise ValueError("Invalid type for 'createdAt'. Expected float or string.")
 
 
-def log_function_call(function_name: str, **kwargs):
-    print(f"\n{function_name} called with parameters:")
-    for key, value in kwargs.items():
-        print(f"\t{key}: {value} (type: {type(value)})")
-    print("\n" + "-" * 50)  
\ No newline at end of file
+def parse_time_bound(value, name: str):
+    """
+    Parses a time window bound into an aware UTC datetime.
+    Accepts epoch milliseconds (as format_datetime returns them) or an ISO 8601
+    string; strings without an offset are read as UTC, like export_datetime writes them.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000, timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"Invalid date format for '{name}'. Expected ISO 8601 or epoch milliseconds.")
+        if parsed.tzinfo is None:
+            return parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
+    raise ValueError(f"Invalid type for '{name}'. Expected epoch milliseconds or string.")
+
+
+def encode_cursor(*values):
+    """
+    Encodes keyset values into an opaque, url-safe cursor string.
+    Datetimes are stored in ISO 8601 format.
+    """
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    Decodes a cursor produced by encode_cursor back into its list of values.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor.")
+    return values
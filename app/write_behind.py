@@ -0,0 +1,195 @@
+# app/write_behind.py
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional
+from . import conversation_cache
+from .ingest import insert_messages
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.environ.get("MESSAGE_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL_MS", "50")) / 1000
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.environ.get("WRITE_BEHIND_ENQUEUE_TIMEOUT", "5"))
+
+FLUSH_SECONDS = Histogram("write_behind_flush_seconds", "Time spent writing one batch of buffered messages")
+FLUSHED_MESSAGES = Counter("write_behind_flushed_messages_total", "Buffered messages written", ["outcome"])
+BACKPRESSURE_WAITS = Counter("write_behind_backpressure_total", "Enqueues that hit a full buffer", ["outcome"])
+
+
+class BufferFullError(Exception):
+    """Raised when the buffer stays full for longer than the enqueue timeout."""
+
+
+class WriteBehindBuffer:
+    """
+    In-process write-behind queue for create_message.
+
+    Messages are acknowledged once enqueued and written by a background task in
+    batched transactions, whenever `max_batch` rows are waiting or every
+    `flush_interval` seconds. Rows stay visible to readers (see `pending_for`)
+    until their batch has committed. When `max_pending` rows are waiting,
+    enqueue blocks for up to `enqueue_timeout` seconds and then fails.
+
+    Acknowledged rows that the database rejects (e.g. an unknown conversation)
+    are logged and counted, since the caller has already moved on. Listeners
+    added with `add_commit_listener` are called with the rows of each batch
+    that were written, once they are durable.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = WRITE_BEHIND_ENABLED,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        enqueue_timeout: float = WRITE_BEHIND_ENQUEUE_TIMEOUT,
+    ):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self._pending: List[dict] = []
+        self._by_conversation: Dict[int, Dict] = defaultdict(dict)
+        self._space = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._commit_listeners: List[Callable[[List[dict]], Awaitable[None]]] = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add_commit_listener(self, listener: Callable[[List[dict]], Awaitable[None]]):
+        self._commit_listeners.append(listener)
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the background task and flushes everything still pending.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    async def enqueue(self, row: dict):
+        if "createdAt" not in row:
+            # Stamp now so pending and flushed rows order the same way
+            row["createdAt"] = datetime.now(timezone.utc)
+        elif row["createdAt"].tzinfo is None:
+            # asyncpg reads naive datetimes as local time; convert the same way so sorting matches
+            row["createdAt"] = row["createdAt"].astimezone(timezone.utc)
+        async with self._space:
+            if len(self._pending) >= self.max_pending:
+                try:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: len(self._pending) < self.max_pending),
+                        self.enqueue_timeout
+                    )
+                    BACKPRESSURE_WAITS.inc(outcome="waited")
+                except asyncio.TimeoutError:
+                    BACKPRESSURE_WAITS.inc(outcome="rejected")
+                    raise BufferFullError("Message buffer is full, try again later.")
+            self._pending.append(row)
+            self._by_conversation[row["conversation_id"]][row["id"]] = row
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_for(self, conversation_id: int) -> List[SimpleNamespace]:
+        """
+        Returns the not yet committed messages of a conversation as row-like objects.
+        """
+        rows = self._by_conversation.get(conversation_id)
+        if not rows:
+            return []
+        return [SimpleNamespace(**row) for row in rows.values()]
+
+    def is_pending(self, message_id) -> bool:
+        return any(message_id in rows for rows in self._by_conversation.values())
+
+    async def flush_message(self, message_id):
+        """
+        Flushes until `message_id` is committed (or rejected), for mutations
+        that are about to update or delete it. It may sit behind several batches.
+        """
+        while self.is_pending(message_id):
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes up to one batch of pending rows. Rows leave the buffer only after
+        their transaction has committed, so readers never miss them.
+        """
+        async with self._flush_lock:
+            batch = self._pending[:self.max_batch]
+            if not batch:
+                return
+            start = time.perf_counter()
+            errors = await insert_messages(batch)
+            FLUSH_SECONDS.observe(time.perf_counter() - start)
+            for row, error in zip(batch, errors):
+                if error is not None:
+                    logger.error("Dropping buffered message %s: %s", row["id"], error)
+            failed = sum(1 for error in errors if error is not None)
+            FLUSHED_MESSAGES.inc(len(batch) - failed, outcome="written")
+            FLUSHED_MESSAGES.inc(failed, outcome="failed")
+            async with self._space:
+                del self._pending[:len(batch)]
+                for row in batch:
+                    rows = self._by_conversation.get(row["conversation_id"])
+                    if rows is not None:
+                        rows.pop(row["id"], None)
+                        if not rows:
+                            del self._by_conversation[row["conversation_id"]]
+                self._space.notify_all()
+            # Loads that ran during the flush may have cached the conversation without these rows
+            for conversation_id in {row["conversation_id"] for row in batch}:
+                conversation_cache.invalidate(conversation_id)
+            written = [row for row, error in zip(batch, errors) if error is None]
+            for listener in self._commit_listeners:
+                try:
+                    await listener(written)
+                except Exception:
+                    # The rows are committed and out of the buffer, so there is nothing to retry
+                    logger.exception("Message buffer commit listener failed")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._pending:
+                    await self.flush()
+                    if len(self._pending) < self.max_batch:
+                        break
+            except Exception:
+                # Keep the rows and retry on the next tick, e.g. while the database is down
+                logger.exception("Flushing the message buffer failed")
+
+
+message_buffer = WriteBehindBuffer()
+
+QUEUE_DEPTH = Gauge(
+    "write_behind_queue_depth", "Messages acknowledged but not yet written",
+    function=lambda: len(message_buffer)
+)
@@ -0,0 +1,92 @@
+# benchmarks/bench_create_messages.py
+"""
+Compares N single create_message calls with one createMessages batch.
+
+Runs the real schema against the database configured in app/database.py:
+
+    python -m benchmarks.bench_create_messages --count 1000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from app.database import engine
+from app.migrations import upgrade
+from app.schema import schema
+
+CREATE_USER = """
+mutation ($username: String!) {
+  createAppUser(username: $username, role: USER, provider: null, image: null) { id }
+}
+"""
+
+CREATE_CONVERSATION = """
+mutation ($appUserId: String!) { createConversation(appUserId: $appUserId) { id } }
+"""
+
+CREATE_MESSAGE = """
+mutation ($id: ID!, $conversationId: ID!, $content: String!) {
+  createMessage(id: $id, author: "bench", content: $content, conversationId: $conversationId) { id }
+}
+"""
+
+CREATE_MESSAGES = """
+mutation ($messages: [MessageInput!]!) {
+  createMessages(messages: $messages) { id success error }
+}
+"""
+
+
+async def execute(query, **variables):
+    result = await schema.execute(query, variable_values=variables, context_value={})
+    if result.errors:
+        raise result.errors[0]
+    return result.data
+
+
+async def setup_conversation() -> str:
+    await upgrade(engine)
+    user = await execute(CREATE_USER, username=f"bench-{uuid.uuid4()}")
+    conversation = await execute(CREATE_CONVERSATION, appUserId=user["createAppUser"]["id"])
+    return conversation["createConversation"]["id"]
+
+
+async def bench_single(conversation_id: str, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        await execute(CREATE_MESSAGE, id=str(uuid.uuid4()), conversationId=conversation_id, content=f"message {i}")
+    return time.perf_counter() - start
+
+
+async def bench_batch(conversation_id: str, count: int, batch_size: int) -> float:
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        messages = [
+            {"id": str(uuid.uuid4()), "author": "bench", "content": f"message {i}", "conversationId": conversation_id}
+            for i in range(offset, min(offset + batch_size, count))
+        ]
+        data = await execute(CREATE_MESSAGES, messages=messages)
+        failures = [item for item in data["createMessages"] if not item["success"]]
+        if failures:
+            raise RuntimeError(f"{len(failures)} messages failed: {failures[0]['error']}")
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    conversation_id = await setup_conversation()
+    single = await bench_single(conversation_id, args.count)
+    batch = await bench_batch(conversation_id, args.count, args.batch_size)
+    print(f"create_message x{args.count}: {single:.3f}s ({args.count / single:,.0f} msg/s)")
+    print(f"createMessages batch={args.batch_size}: {batch:.3f}s ({args.count / batch:,.0f} msg/s)")
+    print(f"speedup: {single / batch:.1f}x")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
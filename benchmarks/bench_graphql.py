@@ -0,0 +1,253 @@
+# benchmarks/bench_graphql.py
+"""
+Measures the main GraphQL operations through the real schema against a local Postgres.
+
+Load a dataset first (see benchmarks/dataset.py), then:
+
+    python -m benchmarks.bench_graphql --output results.json
+    python -m benchmarks.bench_graphql --output new.json --baseline results.json
+
+Each scenario runs `--requests` operations from `--concurrency` concurrent
+clients after `--warmup` unmeasured ones. Results (p50/p99 latency,
+throughput and peak RSS) are written as JSON so runs on different commits
+can be compared. Latencies of failed operations would skew the results, so
+a scenario with any failed operation ends the run with its error count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.schema import schema
+
+CONVERSATIONS = """
+query ($first: Int, $username: String) {
+  conversations(first: $first, username: $username) {
+    pageInfo { endCursor hasNextPage }
+    edges { cursor node { id createdAt tags appUser { username } } }
+  }
+}
+"""
+
+CONVERSATION = """
+query ($id: ID!) {
+  conversation(id: $id) {
+    id createdAt tags
+    appUser { id username }
+    messages { id content author createdAt parentId indent humanFeedback humanFeedbackComment }
+    elements { id type name mime size forIds }
+  }
+}
+"""
+
+CREATE_MESSAGE = """
+mutation ($id: ID!, $conversationId: ID!, $content: String!) {
+  createMessage(id: $id, author: "bench", content: $content, conversationId: $conversationId) { id }
+}
+"""
+
+SET_HUMAN_FEEDBACK = """
+mutation ($messageId: ID!, $humanFeedback: Int!) {
+  setHumanFeedback(messageId: $messageId, humanFeedback: $humanFeedback) { id humanFeedback }
+}
+"""
+
+# Sampled ids the scenarios draw from
+SAMPLE_SIZE = 2000
+
+
+class Workload:
+    """
+    Ids sampled from the loaded dataset, and one variables factory per scenario.
+    """
+
+    def __init__(self, rng: random.Random, users: int, conversation_ids, message_ids):
+        self.rng = rng
+        self.users = users
+        self.conversation_ids = conversation_ids
+        self.message_ids = message_ids
+
+    @classmethod
+    async def sample(cls, seed: int) -> "Workload":
+        async with engine.connect() as conn:
+            users = await conn.scalar(text("SELECT count(*) FROM app_user"))
+            max_conversation = await conn.scalar(text("SELECT coalesce(max(id), 0) FROM conversation"))
+            if not users or not max_conversation:
+                raise SystemExit("The database is empty; load a dataset with `python -m benchmarks.dataset` first.")
+            rng = random.Random(seed)
+            candidates = [rng.randint(1, max_conversation) for _ in range(SAMPLE_SIZE)]
+            conversation_ids = (await conn.execute(
+                text("SELECT id FROM conversation WHERE id = ANY(:ids) ORDER BY id"), {"ids": candidates}
+            )).scalars().all()
+            message_ids = (await conn.execute(
+                text("SELECT id FROM message WHERE conversation_id = ANY(:ids) ORDER BY id LIMIT :limit"),
+                {"ids": list(conversation_ids), "limit": SAMPLE_SIZE * 10}
+            )).scalars().all()
+        return cls(rng, users, conversation_ids, message_ids)
+
+    def conversations(self):
+        return CONVERSATIONS, {"first": 20}
+
+    def conversations_by_user(self):
+        return CONVERSATIONS, {"first": 20, "username": f"user-{self.rng.randint(1, self.users)}"}
+
+    def conversation(self):
+        return CONVERSATION, {"id": str(self.rng.choice(self.conversation_ids))}
+
+    def create_message(self):
+        return CREATE_MESSAGE, {
+            # Random rather than seeded, so repeated runs against one database do not collide
+            "id": str(uuid.uuid4()),
+            "conversationId": str(self.rng.choice(self.conversation_ids)),
+            "content": "benchmark message",
+        }
+
+    def set_human_feedback(self):
+        return SET_HUMAN_FEEDBACK, {
+            "messageId": str(self.rng.choice(self.message_ids)), "humanFeedback": self.rng.choice((-1, 1))
+        }
+
+
+SCENARIOS = ["conversations", "conversations_by_user", "conversation", "create_message", "set_human_feedback"]
+
+
+class ScenarioFailed(Exception):
+    """Raised when operations of a scenario return errors."""
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+async def run_scenario(next_operation, requests: int, concurrency: int, warmup: int) -> dict:
+    latencies = []
+    failures = []
+
+    async def client(count: int, measure: bool):
+        for _ in range(count):
+            query, variables = next_operation()
+            start = time.perf_counter()
+            result = await schema.execute(query, variable_values=variables, context_value={})
+            elapsed = time.perf_counter() - start
+            if result.errors:
+                failures.append(result.errors[0].message)
+            elif measure:
+                latencies.append(elapsed)
+
+    def split(total: int):
+        return [total // concurrency + (i < total % concurrency) for i in range(concurrency)]
+
+    await asyncio.gather(*(client(count, False) for count in split(warmup)))
+    start = time.perf_counter()
+    await asyncio.gather(*(client(count, True) for count in split(requests)))
+    wall = time.perf_counter() - start
+    if failures:
+        raise ScenarioFailed(f"{len(failures)} of {warmup + requests} operations failed, first: {failures[0]}")
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(requests / wall, 1) if wall else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    print(f"{'scenario':24} {'p50 ms':>16} {'p99 ms':>16} {'req/s':>18}")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        cells = []
+        for key in ("p50_ms", "p99_ms", "throughput_rps"):
+            change = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            cells.append(f"{current[key]:>9} ({change:+.0f}%)")
+        print(f"{name:24} " + " ".join(f"{cell:>16}" for cell in cells))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=1000, help="Measured operations per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="Unmeasured operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    try:
+        workload = await Workload.sample(args.seed)
+        async with engine.connect() as conn:
+            dataset = {
+                table: await conn.scalar(text(f"SELECT count(*) FROM {table}"))
+                for table in ("app_user", "conversation", "message", "element")
+            }
+        scenarios = {}
+        for name in args.scenarios:
+            try:
+                scenarios[name] = await run_scenario(getattr(workload, name), args.requests, args.concurrency, args.warmup)
+            except ScenarioFailed as e:
+                raise SystemExit(f"{name}: {e}")
+            print(f"{name:24} {json.dumps(scenarios[name])}")
+    finally:
+        await engine.dispose()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "environment": {key: value for key, value in os.environ.items() if key.startswith(
+                ("DB_", "USER_CACHE_", "CONVERSATION_CACHE_", "MESSAGE_WRITE_BEHIND", "WRITE_BEHIND_")
+            )},
+        },
+        "dataset": dataset,
+        "scenarios": scenarios,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
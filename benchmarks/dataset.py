@@ -0,0 +1,235 @@
+# benchmarks/dataset.py
+"""
+Generates a reproducible synthetic chat dataset and bulk loads it with COPY.
+
+The same --seed and scale always produce the same rows, ids included:
+
+    python -m benchmarks.dataset --users 10000 --conversations 1000000 --messages 10000000 --reset
+
+Users are named user-<n> (n from 1), so benchmarks can address them without
+reading the dataset back.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.migrations import upgrade
+
+# Rows buffered per table before they are copied
+COPY_BATCH = 50_000
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WORDS = (
+    "model prompt answer question python error database query index cache latency token stream "
+    "function request response server client deploy config timeout retry memory thread async "
+    "message conversation feedback summary document search vector embedding chart table file "
+    "upload image code review test build release metric trace log user agent tool result"
+).split()
+ELEMENT_TYPES = (("image", "image/png"), ("text", "text/plain"), ("pdf", "application/pdf"), ("file", "text/csv"))
+
+USER_COLUMNS = ["id", "username", "createdAt", "role", "image", "provider", "tags"]
+CONVERSATION_COLUMNS = ["id", "createdAt", "isError", "appUserId", "tags"]
+MESSAGE_COLUMNS = [
+    "id", "content", "createdAt", "isError", "author", "language", "prompt", "parentId", "indent",
+    "authorIsUser", "disableHumanFeedback", "waitForAnswer", "conversation_id", "humanFeedback",
+    "humanFeedbackComment",
+]
+ELEMENT_COLUMNS = [
+    "id", "conversation_id", "type", "name", "mime", "url", "display", "language", "size", "object_key", "for_ids"
+]
+
+
+@dataclass
+class Scale:
+    users: int = 1000
+    conversations: int = 10_000
+    messages: int = 200_000
+    # Average elements per conversation
+    elements: float = 0.2
+    # Share of messages that reply to an earlier message of their conversation
+    thread_ratio: float = 0.3
+    max_indent: int = 5
+    # Share of assistant messages that carry human feedback
+    feedback_ratio: float = 0.05
+
+
+class Generator:
+    """
+    Yields dataset rows in insertion order: every parent before its children.
+    """
+
+    def __init__(self, scale: Scale, seed: int):
+        self.scale = scale
+        self.rng = random.Random(seed)
+
+    def uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def text(self, low: int, high: int) -> str:
+        return " ".join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def users(self):
+        for user_id in range(1, self.scale.users + 1):
+            yield (
+                user_id, f"user-{user_id}", START + timedelta(minutes=user_id), "USER",
+                None, "credentials", json.dumps([]),
+            )
+
+    def message_counts(self):
+        """
+        Splits the message total over conversations with a long tail, so a few
+        conversations are much longer than the average.
+        """
+        weights = [self.rng.paretovariate(2.0) for _ in range(self.scale.conversations)]
+        total = sum(weights)
+        counts = [int(self.scale.messages * weight / total) for weight in weights]
+        for index in range(self.scale.messages - sum(counts)):
+            counts[index % len(counts)] += 1
+        return counts
+
+    def conversations(self):
+        """
+        Yields (conversation, messages, elements) for every conversation.
+        """
+        span = timedelta(days=365).total_seconds()
+        for conversation_id, message_count in enumerate(self.message_counts(), start=1):
+            created_at = START + timedelta(seconds=span * conversation_id / self.scale.conversations)
+            conversation = (
+                conversation_id, created_at, False, self.rng.randint(1, self.scale.users),
+                json.dumps(self.rng.sample(["chat", "support", "code", "eval"], k=self.rng.randint(0, 2))),
+            )
+            messages = self.messages(conversation_id, created_at, message_count)
+            yield conversation, messages, self.elements(conversation_id, messages)
+
+    def messages(self, conversation_id: int, created_at: datetime, count: int):
+        rows = []
+        # (id, indent) of the messages written so far
+        written = []
+        for position in range(count):
+            parent_id, indent = None, 0
+            if written and self.rng.random() < self.scale.thread_ratio:
+                parent_id, parent_indent = self.rng.choice(written[-5:])
+                indent = min(parent_indent + 1, self.scale.max_indent)
+            author_is_user = parent_id is None and position % 2 == 0
+            feedback = comment = None
+            if not author_is_user and self.rng.random() < self.scale.feedback_ratio:
+                feedback = self.rng.choice((-1, 1))
+                comment = self.text(3, 12) if self.rng.random() < 0.3 else None
+            message_id = self.uuid()
+            rows.append((
+                message_id, self.text(5, 60), created_at + timedelta(seconds=position * 7 + self.rng.random()),
+                False, "User" if author_is_user else "Assistant", None, None, parent_id, indent,
+                author_is_user, False, False, conversation_id, feedback, comment,
+            ))
+            written.append((message_id, indent))
+        return rows
+
+    def elements(self, conversation_id: int, messages):
+        count = int(self.scale.elements) + (self.rng.random() < self.scale.elements % 1)
+        rows = []
+        for _ in range(count if messages else 0):
+            element_type, mime = self.rng.choice(ELEMENT_TYPES)
+            rows.append((
+                self.uuid(), conversation_id, element_type, f"{element_type}-{self.rng.randint(1, 10**6)}", mime,
+                None, "inline", None, str(self.rng.randint(1_000, 5_000_000)), None,
+                json.dumps([str(self.rng.choice(messages)[0])]),
+            ))
+        return rows
+
+
+async def copy_rows(conn, table: str, columns, rows):
+    if rows:
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table, records=rows, columns=columns)
+
+
+async def load(scale: Scale, seed: int, reset: bool = False) -> dict:
+    """
+    Loads the dataset into the configured database and returns the row counts.
+    """
+    await upgrade(engine)
+    generator = Generator(scale, seed)
+    counts = {"users": 0, "conversations": 0, "messages": 0, "elements": 0}
+    async with engine.begin() as conn:
+        if reset:
+            # Every table with a foreign key to these has to be truncated with them
+            await conn.exec_driver_sql(
+                "TRUNCATE message, element, imported_conversation, conversation_feedback_stats, user_feedback_stats, "
+                "conversation, app_user RESTART IDENTITY"
+            )
+        elif await conn.scalar(text("SELECT EXISTS (SELECT 1 FROM app_user)")):
+            raise SystemExit("The database already has users; pass --reset to replace them with the dataset.")
+        users = list(generator.users())
+        for offset in range(0, len(users), COPY_BATCH):
+            await copy_rows(conn, "app_user", USER_COLUMNS, users[offset:offset + COPY_BATCH])
+        counts["users"] = len(users)
+
+        conversations, messages, elements = [], [], []
+        for conversation, conversation_messages, conversation_elements in generator.conversations():
+            conversations.append(conversation)
+            messages.extend(conversation_messages)
+            elements.extend(conversation_elements)
+            if len(messages) >= COPY_BATCH or len(conversations) >= COPY_BATCH:
+                await flush(conn, conversations, messages, elements, counts)
+        await flush(conn, conversations, messages, elements, counts)
+
+        for table in ("app_user", "conversation"):
+            await conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"
+            )
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.exec_driver_sql("ANALYZE")
+    return counts
+
+
+async def flush(conn, conversations, messages, elements, counts):
+    # Conversations first: messages and elements reference them
+    await copy_rows(conn, "conversation", CONVERSATION_COLUMNS, conversations)
+    await copy_rows(conn, "message", MESSAGE_COLUMNS, messages)
+    await copy_rows(conn, "element", ELEMENT_COLUMNS, elements)
+    counts["conversations"] += len(conversations)
+    counts["messages"] += len(messages)
+    counts["elements"] += len(elements)
+    conversations.clear()
+    messages.clear()
+    elements.clear()
+
+
+def add_scale_arguments(parser: argparse.ArgumentParser):
+    defaults = Scale()
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--conversations", type=int, default=defaults.conversations)
+    parser.add_argument("--messages", type=int, default=defaults.messages)
+    parser.add_argument("--elements", type=float, default=defaults.elements, help="Average elements per conversation")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def scale_from_arguments(args) -> Scale:
+    return Scale(users=args.users, conversations=args.conversations, messages=args.messages, elements=args.elements)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_scale_arguments(parser)
+    parser.add_argument("--reset", action="store_true", help="Empty the tables before loading")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        counts = await load(scale_from_arguments(args), args.seed, reset=args.reset)
+    finally:
+        await engine.dispose()
+    elapsed = time.perf_counter() - start
+    print(", ".join(f"{count:,} {name}" for name, count in counts.items()) + f" loaded in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
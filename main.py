@@ -1,14 +1,65 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from strawberry.fastapi import GraphQLRouter
+from fastapi.responses import PlainTextResponse
 from app.schema import schema
-from app.database import engine, Base
+from app.database import engine, pool_stats
+from app.migrations import check_schema_version
+from app.loaders import get_context
+from app.write_behind import message_buffer
+from app.purge import conversation_purger
+from app.partitions import partition_maintainer
+from app.pubsub import pubsub
+from app.export import router as export_router
+from app.bulk_import import router as import_router
+from app.storage import router as storage_router
+from app.cache import cache_stats
+from app.logs import configure_logging
+from app.metrics import render_prometheus
+from app.persisted_queries import PERSISTED_QUERIES_FILE, PersistedQueryRouter, registry
 
-app = FastAPI()
+configure_logging()
 
-@app.on_event("startup")
-async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
 
-graphql_app = GraphQLRouter(schema)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema changes are applied ahead of deploy with `python -m app.migrate upgrade`
+    await check_schema_version(engine)
+    if PERSISTED_QUERIES_FILE:
+        registry.load(PERSISTED_QUERIES_FILE, schema=schema)
+    await message_buffer.start()
+    await conversation_purger.start()
+    await partition_maintainer.start()
+    await pubsub.start()
+    yield
+    await pubsub.stop()
+    await partition_maintainer.stop()
+    await conversation_purger.stop()
+    # Acknowledged messages must reach the database before the worker exits
+    await message_buffer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+graphql_app = PersistedQueryRouter(schema, context_getter=get_context)
 app.include_router(graphql_app, prefix="/api/graphql")
+app.include_router(export_router)
+app.include_router(import_router)
+app.include_router(storage_router)
+
+
+@app.get("/api/pool")
+async def pool():
+    """Live connection pool statistics for this worker."""
+    return pool_stats()
+
+
+@app.get("/api/cache")
+async def cache():
+    """Size and hit statistics of this worker's in-process caches."""
+    return cache_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics of this worker."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
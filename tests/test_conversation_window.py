@@ -0,0 +1,58 @@
+# tests/test_conversation_window.py
+"""
+conversations(since:, until:) returns conversations with messages created in
+[since, until), given as epoch milliseconds or ISO 8601 strings.
+"""
+import uuid
+
+CREATED_AT = "2026-03-01T12:00:00.250Z"
+CREATED_AT_MS = 1772366400250
+
+QUERY = '''
+query($username: String, $since: StringOrFloat, $until: StringOrFloat) {
+  conversations(username: $username, since: $since, until: $until) { edges { node { id } } }
+}
+'''
+
+
+def data(result) -> dict:
+    assert result.errors is None, result.errors
+    return result.data
+
+
+def window(execute, username, since=None, until=None) -> list:
+    result = execute(QUERY, username=username, since=since, until=until)
+    return [edge["node"]["id"] for edge in data(result)["conversations"]["edges"]]
+
+
+def test_window_edges(execute):
+    username = f"test-{uuid.uuid4()}"
+    user_id = data(execute(
+        'mutation($username: String!) { createAppUser(username: $username, role: USER, provider: null, image: null) { id } }',
+        username=username
+    ))["createAppUser"]["id"]
+    conversation_id = data(execute(
+        'mutation($user: String) { createConversation(appUserId: $user) { id } }', user=user_id
+    ))["createConversation"]["id"]
+    data(execute(
+        'mutation($id: ID!, $conversation: ID!, $createdAt: StringOrFloat) { createMessage(id: $id, author: "test", content: "hello", conversationId: $conversation, createdAt: $createdAt) { id } }',
+        id=str(uuid.uuid4()), conversation=conversation_id, createdAt=CREATED_AT
+    ))
+
+    # since is inclusive
+    assert window(execute, username, since=CREATED_AT_MS) == [conversation_id]
+    assert window(execute, username, since=CREATED_AT) == [conversation_id]
+    assert window(execute, username, since=float(CREATED_AT_MS)) == [conversation_id]
+    assert window(execute, username, since=CREATED_AT_MS + 1) == []
+    # until is exclusive
+    assert window(execute, username, until=CREATED_AT_MS) == []
+    assert window(execute, username, until="2026-03-01T13:00:00.250+01:00") == []
+    assert window(execute, username, until=CREATED_AT_MS + 1) == [conversation_id]
+    assert window(execute, username, since=CREATED_AT_MS, until=CREATED_AT_MS + 1) == [conversation_id]
+    # ISO strings without an offset are UTC
+    assert window(execute, username, since="2026-03-01T12:00:00.250", until="2026-03-01T12:00:00.251") == [conversation_id]
+
+
+def test_window_rejects_malformed_bounds(execute):
+    result = execute(QUERY, username=None, since="yesterday", until=None)
+    assert "Invalid date format for 'since'" in result.errors[0].message
@@ -0,0 +1,113 @@
+# tests/test_mutation_statements.py
+"""
+Every mutation completes in one SQL statement, as counted by SQLAccounting.
+"""
+import uuid
+
+
+def statements(result) -> int:
+    assert result.errors is None, result.errors
+    return result.extensions["sql"]["statements"]
+
+
+def test_create_app_user(execute):
+    result = execute(
+        'mutation($username: String!) { createAppUser(username: $username, role: USER, provider: null, image: null) { id createdAt } }',
+        username=f"test-{uuid.uuid4()}"
+    )
+    assert statements(result) == 1
+
+
+def test_create_app_user_taken(execute):
+    username = f"test-{uuid.uuid4()}"
+    query = 'mutation($username: String!) { createAppUser(username: $username, role: USER, provider: null, image: null) { id } }'
+    assert execute(query, username=username).errors is None
+    result = execute(query, username=username)
+    assert "already taken" in result.errors[0].message
+    assert result.extensions["sql"]["statements"] == 1
+
+
+def test_update_user(execute, user_id):
+    result = execute(
+        'mutation($id: ID!, $username: String!) { updateUser(id: $id, userData: {username: $username, role: ADMIN, image: null, provider: null}) { id role } }',
+        id=user_id, username=f"test-{uuid.uuid4()}"
+    )
+    assert statements(result) == 1
+    assert result.data["updateUser"]["role"] == "ADMIN"
+
+
+def test_delete_user(execute, user_id):
+    result = execute('mutation($id: ID!) { deleteUser(id: $id) }', id=user_id)
+    assert statements(result) == 1
+
+
+def test_create_conversation(execute, user_id):
+    result = execute('mutation($user: String) { createConversation(appUserId: $user, tags: ["a"]) { id createdAt tags } }', user=user_id)
+    assert statements(result) == 1
+
+
+def test_create_conversation_unknown_user(execute):
+    result = execute('mutation { createConversation(appUserId: "-1") { id } }')
+    assert result.errors[0].message == "Invalid appUserId"
+    assert result.extensions["sql"]["statements"] == 1
+
+
+def test_update_conversation(execute, conversation_id):
+    result = execute(
+        'mutation($id: ID!) { updateConversation(conversationData: {id: $id, tags: ["x", "y"]}) { id tags } }',
+        id=conversation_id
+    )
+    assert statements(result) == 1
+    assert result.data["updateConversation"]["tags"] == ["x", "y"]
+
+
+def test_delete_conversation(execute, conversation_id):
+    result = execute('mutation($id: ID!) { deleteConversation(id: $id) { id } }', id=conversation_id)
+    assert statements(result) == 1
+
+
+def test_create_message(execute, conversation_id):
+    result = execute(
+        'mutation($id: ID!, $conversation: ID!) { createMessage(id: $id, author: "a", content: "hi", conversationId: $conversation) { id } }',
+        id=str(uuid.uuid4()), conversation=conversation_id
+    )
+    assert statements(result) == 1
+
+
+def test_create_messages(execute, conversation_id):
+    result = execute(
+        'mutation($messages: [MessageInput!]!) { createMessages(messages: $messages) { id success } }',
+        messages=[
+            {"id": str(uuid.uuid4()), "author": "a", "content": str(i), "conversationId": conversation_id}
+            for i in range(3)
+        ]
+    )
+    assert statements(result) == 1
+    assert all(item["success"] for item in result.data["createMessages"])
+
+
+def test_set_human_feedback(execute, message_id):
+    result = execute(
+        'mutation($id: ID!) { setHumanFeedback(messageId: $id, humanFeedback: 1, humanFeedbackComment: "ok") { id humanFeedback } }',
+        id=message_id
+    )
+    assert statements(result) == 1
+    assert result.data["setHumanFeedback"]["humanFeedback"] == 1
+
+
+def test_update_message(execute, message_id):
+    result = execute('mutation($id: ID!) { updateMessage(messageId: $id, author: "a", content: "edited") { id } }', id=message_id)
+    assert statements(result) == 1
+
+
+def test_delete_message(execute, message_id):
+    result = execute('mutation($id: ID!) { deleteMessage(id: $id) }', id=message_id)
+    assert statements(result) == 1
+
+
+def test_create_element(execute, conversation_id):
+    result = execute(
+        'mutation($conversation: ID!) { createElement(conversationId: $conversation, type: "file", name: "f", display: "inline", forIds: []) { id } }',
+        conversation=conversation_id
+    )
+    assert statements(result) == 1
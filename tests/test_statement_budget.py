@@ -0,0 +1,85 @@
+# tests/test_statement_budget.py
+"""
+Representative queries stay within SQL_STATEMENT_BUDGET however many rows they
+return, so a resolver that starts querying per row (an N+1) fails here.
+"""
+import uuid
+import pytest
+from app import instrumentation
+
+# Statements of the largest query below: the page, then one batch per relationship
+STATEMENT_BUDGET = 4
+
+CONVERSATIONS = """
+query($username: String) {
+  conversations(first: 20, username: $username) {
+    edges { node { id tags appUser { id username } messages { id content humanFeedback } elements { id name } } }
+  }
+}
+"""
+CONVERSATION = """
+query($id: ID!) {
+  conversation(id: $id) { id tags appUser { id username } messages { id content } elements { id name } }
+}
+"""
+
+
+@pytest.fixture
+def statement_budget(monkeypatch):
+    monkeypatch.setattr(instrumentation, "SQL_STATEMENT_BUDGET", STATEMENT_BUDGET)
+    return STATEMENT_BUDGET
+
+
+@pytest.fixture
+def username(execute) -> str:
+    """
+    A user with five conversations of three messages and two elements each.
+    """
+    username = f"test-{uuid.uuid4()}"
+    result = execute(
+        'mutation($username: String!) { createAppUser(username: $username, role: USER, provider: null, image: null) { id } }',
+        username=username
+    )
+    user_id = result.data["createAppUser"]["id"]
+    for _ in range(5):
+        result = execute('mutation($user: String) { createConversation(appUserId: $user, tags: ["t"]) { id } }', user=user_id)
+        conversation_id = result.data["createConversation"]["id"]
+        result = execute(
+            'mutation($messages: [MessageInput!]!) { createMessages(messages: $messages) { success } }',
+            messages=[
+                {"id": str(uuid.uuid4()), "author": "a", "content": str(i), "conversationId": conversation_id}
+                for i in range(3)
+            ]
+        )
+        assert all(item["success"] for item in result.data["createMessages"])
+        for name in ("a", "b"):
+            execute(
+                'mutation($conversation: ID!, $name: String!) { createElement(conversationId: $conversation, type: "file", name: $name, display: "inline", forIds: []) { id } }',
+                conversation=conversation_id, name=name
+            )
+    return username
+
+
+def test_conversations_within_budget(execute, statement_budget, username):
+    result = execute(CONVERSATIONS, username=username)
+    assert result.errors is None, result.errors
+    edges = result.data["conversations"]["edges"]
+    assert len(edges) == 5
+    assert all(len(edge["node"]["messages"]) == 3 and len(edge["node"]["elements"]) == 2 for edge in edges)
+    assert result.extensions["sql"]["statements"] <= statement_budget
+
+
+def test_conversation_within_budget(execute, statement_budget, username):
+    result = execute(CONVERSATIONS, username=username)
+    conversation_id = result.data["conversations"]["edges"][0]["node"]["id"]
+    result = execute(CONVERSATION, id=conversation_id)
+    assert result.errors is None, result.errors
+    assert result.data["conversation"]["appUser"]["username"] == username
+    assert len(result.data["conversation"]["messages"]) == 3
+    assert result.extensions["sql"]["statements"] <= statement_budget
+
+
+def test_budget_exceeded(execute, monkeypatch, username):
+    monkeypatch.setattr(instrumentation, "SQL_STATEMENT_BUDGET", 1)
+    with pytest.raises(instrumentation.StatementBudgetExceeded):
+        execute(CONVERSATIONS, username=username)
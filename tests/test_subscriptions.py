@@ -0,0 +1,54 @@
+# tests/test_subscriptions.py
+"""
+messageEvents delivers messages as they are stored.
+"""
+import asyncio
+import uuid
+from app.pubsub import pubsub
+from app.schema import schema
+
+SUBSCRIPTION = """
+subscription($conversation: ID!) {
+  messageEvents(conversationId: $conversation) { event messageId message { id content createdAt } }
+}
+"""
+CREATE_MESSAGES = 'mutation($messages: [MessageInput!]!) { createMessages(messages: $messages) { id success } }'
+MESSAGES = 'query($id: ID!) { conversation(id: $id) { messages { id createdAt } } }'
+
+
+async def collect_events(conversation_id: str, count: int, mutation: str, **variables):
+    """
+    Subscribes to a conversation, runs `mutation` and returns the first `count` events.
+    """
+    events = await schema.subscribe(SUBSCRIPTION, variable_values={"conversation": conversation_id})
+    subscribers = pubsub.subscriber_count()
+    first = asyncio.ensure_future(events.__anext__())
+    # The subscription registers once the generator starts running
+    for _ in range(100):
+        if pubsub.subscriber_count() > subscribers:
+            break
+        await asyncio.sleep(0.01)
+    result = await schema.execute(mutation, variable_values=variables)
+    assert result.errors is None, result.errors
+    received = [await asyncio.wait_for(first, 5)]
+    while len(received) < count:
+        received.append(await asyncio.wait_for(events.__anext__(), 5))
+    await events.aclose()
+    for event in received:
+        assert event.errors is None, event.errors
+    return [event.data["messageEvents"] for event in received]
+
+
+def test_create_messages_publishes_stored_created_at(run, execute, conversation_id):
+    messages = [
+        {"id": str(uuid.uuid4()), "author": "a", "content": "default", "conversationId": conversation_id},
+        {"id": str(uuid.uuid4()), "author": "a", "content": "given", "conversationId": conversation_id,
+         "createdAt": 1767225600.5},
+    ]
+    events = run(collect_events(conversation_id, 2, CREATE_MESSAGES, messages=messages))
+    assert [event["event"] for event in events] == ["create_message", "create_message"]
+    published = {event["messageId"]: event["message"]["createdAt"] for event in events}
+    assert all(published.values())
+
+    stored = execute(MESSAGES, id=conversation_id).data["conversation"]["messages"]
+    assert published == {message["id"]: message["createdAt"] for message in stored}